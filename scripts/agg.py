@@ -0,0 +1,181 @@
+"""
+agg.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Run the library and footprint builders, the compilers and the checkers in a
+single process, sharing the scan of the library directory between stages and
+reporting how long each stage took.
+
+Usage: agg.py <command>... [--verify] [--incremental] [--jobs N]
+
+Commands:
+    build       Build all generated libraries and footprints
+    compile     Compile agg-kicad.lib and agg-kicad.pro
+    check       Check all libraries and footprints
+    verify      Verify generated and compiled files are up-to-date
+
+With --verify, build and compile check their outputs are up-to-date instead
+of writing them, and with --incremental as well only outputs whose inputs
+have changed since they were last verified are checked. With --jobs, check
+uses N worker processes. Exits with 1 if any stage fails.
+"""
+
+from __future__ import print_function, division
+
+import sys
+import time
+
+import build_lib_connector
+import build_lib_ic
+import build_lib_power
+import build_lib_switch
+import build_mod_chip
+import build_mod_ic
+import build_mod_jstpa
+import build_mod_sil_dil
+import compile_lib
+import compile_pro
+import check_lib
+import check_mod
+import git_version
+
+LIB_PATH = "lib/"
+PRETTY_PATH = "agg.pretty/"
+COMPILED_LIB = "agg-kicad.lib"
+COMPILED_PRO = "agg-kicad.pro"
+
+# Builders as (stage name, module, output path, whether to verify it,
+# whether it supports incremental verification)
+BUILDERS = (
+    ("lib-connector", build_lib_connector, "lib/connector/conn.lib",
+     True, False),
+    ("lib-switch", build_lib_switch, "lib/ui/switch.lib", False, False),
+    ("lib-ic", build_lib_ic, LIB_PATH, True, True),
+    ("lib-power", build_lib_power, "lib/power/power.lib", True, False),
+    ("mod-chip", build_mod_chip, PRETTY_PATH, True, True),
+    ("mod-ic", build_mod_ic, PRETTY_PATH, True, True),
+    ("mod-jstpa", build_mod_jstpa, PRETTY_PATH, True, True),
+    ("mod-sil-dil", build_mod_sil_dil, PRETTY_PATH, True, True),
+)
+
+
+class Stages:
+    """
+    Runs each stage, recording its time and whether it succeeded, and holds
+    the paths of the libraries in the library directory once listed so that
+    later stages can share them. Stages which write libraries must call
+    `changed`, which also forgets the git version. Checkers use `jobs` worker
+    processes.
+    """
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+        self.times = []
+        self.ok = True
+        self._libpaths = None
+
+    def run(self, name, f, *args, **kwargs):
+        t0 = time.time()
+        result = f(*args, **kwargs)
+        self.times.append((name, time.time() - t0))
+        if result is False:
+            print("Error: {} failed.".format(name), file=sys.stderr)
+            self.ok = False
+        return result
+
+    def libpaths(self):
+        if self._libpaths is None:
+            self._libpaths = list(compile_lib.libpaths(LIB_PATH))
+        return self._libpaths
+
+    def changed(self):
+        self._libpaths = None
+        # Written files may change whether the tree is dirty
+        git_version.clear()
+
+    def report(self):
+        print("")
+        for name, t in self.times:
+            print("{:<24} {:.3f}s".format(name, t))
+        print("{:<24} {:.3f}s".format("total", sum(t for n, t in self.times)))
+
+
+def run_build(stages, verify=False, incremental=False):
+    for name, module, path, verified, has_incremental in BUILDERS:
+        if verify and not verified:
+            continue
+        if verify and has_incremental:
+            stages.run("verify-" + name, module.main, path, verify=True,
+                       incremental=incremental)
+        elif verify:
+            stages.run("verify-" + name, module.main, path, verify=True)
+        else:
+            stages.run("build-" + name, module.main, path)
+            stages.changed()
+        if not stages.ok:
+            return
+
+
+def run_compile(stages, verify=False, incremental=False):
+    # The compiled library is streamed from each library in turn
+    if verify:
+        stages.run("verify-lib", compile_lib.checklib,
+                   LIB_PATH, COMPILED_LIB, incremental)
+        if stages.ok:
+            stages.run("verify-pro", compile_pro.checkprj,
+                       LIB_PATH, COMPILED_PRO, stages.libpaths(), incremental)
+    else:
+        stages.run("compile-lib", compile_lib.writelib,
+                   LIB_PATH, COMPILED_LIB)
+        stages.run("compile-pro", compile_pro.writeprj,
+                   LIB_PATH, COMPILED_PRO, stages.libpaths())
+
+
+def run_check(stages, verify=False, incremental=False):
+    # Libraries with cached results need not be parsed, so are not read here
+    stages.run("check-lib", check_lib.main,
+               LIB_PATH, PRETTY_PATH, stages.jobs)
+    if stages.ok:
+        stages.run("check-mod", check_mod.main, PRETTY_PATH, stages.jobs)
+
+
+def run_verify(stages, verify=True, incremental=False):
+    run_build(stages, True, incremental)
+    if stages.ok:
+        run_compile(stages, True, incremental)
+
+
+COMMANDS = {"build": run_build, "compile": run_compile, "check": run_check,
+           "verify": run_verify}
+
+
+def main(commands, verify=False, incremental=False, jobs=1):
+    stages = Stages(jobs)
+    for command in commands:
+        COMMANDS[command](stages, verify, incremental)
+        if not stages.ok:
+            break
+    stages.report()
+    return stages.ok
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    jobs = 1
+    if "--jobs" in args:
+        idx = args.index("--jobs")
+        jobs = args[idx + 1] if idx + 1 < len(args) else ""
+        del args[idx:idx + 2]
+    verify_flag = "--verify" in args
+    incremental_flag = "--incremental" in args
+    flags = ("--verify", "--incremental")
+    commands = [arg for arg in args if arg not in flags]
+    if not commands or any(c not in COMMANDS for c in commands) or \
+            not str(jobs).isdigit():
+        print("Usage: {} <build|compile|check|verify>... "
+              "[--verify] [--incremental] [--jobs N]".format(sys.argv[0]))
+        sys.exit(1)
+    if main(commands, verify_flag, incremental_flag, int(jobs)):
+        sys.exit(0)
+    else:
+        sys.exit(1)
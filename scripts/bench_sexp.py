@@ -0,0 +1,176 @@
+"""
+bench_sexp.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Benchmark the S-expression parser against the original per-character parser,
+and the peak memory of parsing a whole board against streaming it with
+iterparse or loading it through a memory map, and the time taken by select
+queries against equivalent scans, using either a given .kicad_pcb file or a
+synthetic board of the given size.
+
+Usage: bench_sexp.py [<.kicad_pcb file> | <number of segments>]
+"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+import sexp
+
+
+def parse_chars(s):
+    """
+    The original per-character parser, kept as a reference for timing and
+    for checking the new parser produces identical trees.
+    """
+    r = [[]]
+    token = None
+    quote = False
+    for c in s:
+        if c == '(' and not quote:
+            r.append([])
+        elif c in (')', ' ', '\n') and not quote:
+            if token is not None:
+                r[-1].append(token)
+            token = None
+            if c == ')':
+                t = r.pop()
+                r[-1].append(t)
+        elif c == '"':
+            quote = not quote
+            if not token and not quote:
+                token = "~"
+        else:
+            if token is None:
+                token = ''
+            token += c
+    return r[0][0]
+
+
+def synthetic_board(n_segments):
+    """Generate the text of a board with `n_segments` tracks and some parts."""
+    board = ["kicad_pcb", ["version", 4], ["host", "pcbnew", "4.0.2-stable"],
+             ["general", ["area", 0, 0, 100, 100]]]
+    for i in range(n_segments):
+        board.append(["segment", ["start", i * 0.1, 10.0],
+                      ["end", i * 0.1 + 2.54, 12.7], ["width", 0.25],
+                      ["layer", "F.Cu"], ["net", i % 32]])
+    for i in range(n_segments // 20):
+        board.append(["module", "agg:0402", ["layer", "F.Cu"],
+                      ["tedit", "5680BCD7"], ["at", i * 1.5, 20.0, 90],
+                      ["fp_text", "reference", "R{}".format(i),
+                       ["at", 0, -1.45], ["layer", "F.Fab"]],
+                      ["fp_text", "value", "", ["at", 0, 1.45],
+                       ["layer", "F.Fab"]],
+                      ["pad", 1, "smd", "rect", ["at", -0.45, 0],
+                       ["size", 0.62, 0.62], ["layers", "F.Cu", "F.Mask"]]])
+    return sexp.generate(board)
+
+
+def timeit(f, *args):
+    t0 = time.time()
+    result = f(*args)
+    return time.time() - t0, result
+
+
+def peak_memory(f, *args):
+    tracemalloc.start()
+    f(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def load_whole(path):
+    with open(path) as f:
+        return len(sexp.parse(f.read()))
+
+
+def load_streaming(path):
+    with open(path) as f:
+        return sum(1 for node in sexp.iterparse(f))
+
+
+QUERIES = ("module", "module/fp_text[1=reference]", "segment[layer=F.Cu]",
+           "module/pad[layers~F.Cu]/at")
+
+
+def query_scan(board):
+    """Answer QUERIES by scanning with list comprehensions."""
+    def named(nodes, name):
+        return [child for node in nodes for child in node
+                if isinstance(child, list) and child and child[0] == name]
+    modules = named([board], "module")
+    refs = [t for t in named(modules, "fp_text") if t[1] == "reference"]
+    segments = [s for s in named([board], "segment")
+                if named([s], "layer")[0][1] == "F.Cu"]
+    pads = [p for p in named(modules, "pad")
+            if "F.Cu" in named([p], "layers")[0][1:]]
+    return [modules, refs, segments, named(pads, "at")]
+
+
+def query_select(board):
+    """Answer QUERIES using sexp.select."""
+    return [list(sexp.select(board, query)) for query in QUERIES]
+
+
+def main(source):
+    if source.isdigit():
+        text = synthetic_board(int(source))
+        fd, path = tempfile.mkstemp(suffix=".kicad_pcb")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        print("Synthetic board with {} segments, {:.1f}MB"
+              .format(source, len(text) / 1e6))
+    else:
+        path = source
+        with open(path) as f:
+            text = f.read()
+        print("Board '{}', {:.1f}MB".format(source, len(text) / 1e6))
+
+    try:
+        t_old, old = timeit(parse_chars, text)
+        t_new, new = timeit(sexp.parse, text)
+        assert old == new, "Parsers produced different trees"
+        print("parse:       {:.3f}s (per-character: {:.3f}s, {:.1f}x faster)"
+              .format(t_new, t_old, t_old / t_new))
+        del text, old, new
+
+        t_stream, _ = timeit(load_streaming, path)
+        m_whole = peak_memory(load_whole, path)
+        m_stream = peak_memory(load_streaming, path)
+        print("iterparse:   {:.3f}s, peak {:.1f}MB (parse: peak {:.1f}MB)"
+              .format(t_stream, m_stream / 1e6, m_whole / 1e6))
+
+        t_mapped, _ = timeit(sexp.load, path)
+        m_mapped = peak_memory(sexp.load, path)
+        print("load:        {:.3f}s, peak {:.1f}MB"
+              .format(t_mapped, m_mapped / 1e6))
+
+        board = sexp.load(path, nodes=True)
+        t_index, found = timeit(query_select, board)
+        assert found == query_scan(board), "Queries found different nodes"
+        t_scan, _ = timeit(query_scan, board)
+        t_select, _ = timeit(query_select, board)
+        print("select:      {:.3f}s (scan: {:.3f}s, {:.1f}x faster; "
+              "{:.3f}s when indexing)"
+              .format(t_select, t_scan, t_scan / t_select, t_index))
+    finally:
+        if path != source:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        main("50000")
+    elif len(sys.argv) == 2:
+        main(sys.argv[1])
+    else:
+        print("Usage: {} [<.kicad_pcb file> | <number of segments>]"
+              .format(sys.argv[0]))
+        sys.exit(1)
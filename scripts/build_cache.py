@@ -0,0 +1,261 @@
+"""
+build_cache.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+A persistent record of which generated parts are known to be up to date, so
+builders can skip regenerating and comparing parts that have not changed, and
+of the results of checking each file, so checkers can skip unchanged files.
+"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import ast
+import json
+import hashlib
+import tempfile
+
+CACHE_NAME = ".agg-build-cache.json"
+
+# Bump when the layout of the cache changes, to discard old caches
+CACHE_VERSION = 2
+
+# Section holding the code hash of each module, see BuildCache.code_hash
+CODE_SECTION = "_code"
+
+# File in the user's cache directory holding check results, see CheckCache
+CHECK_CACHE_NAME = "checks.json"
+
+# Most check results kept for each checker, dropping the least recently used
+CHECK_CACHE_SIZE = 10000
+
+
+def file_hash(path):
+    """Return the SHA1 of the file at `path`, or None if it does not exist."""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def file_stat(path):
+    """Return [mtime in ns, size] of the file at `path`, or None."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def cache_dir():
+    """Return the directory for agg-kicad caches kept outside the tree."""
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "agg-kicad")
+
+
+def write_json(path, data, sort_keys=True):
+    """
+    Write `data` to `path` as JSON, replacing the file in one step so that
+    concurrent readers never see it partly written.
+    """
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=sort_keys)
+        os.replace(tmppath, path)
+    except Exception:
+        os.remove(tmppath)
+        raise
+
+
+def read_json(path):
+    """Return the JSON in `path`, or an empty dict if it cannot be read."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _module_file(module):
+    return sys.modules[module].__file__
+
+
+def _is_config(node):
+    return isinstance(node, ast.Assign) and \
+        any(isinstance(t, ast.Name) and t.id == "config" for t in node.targets)
+
+
+class BuildCache:
+    """
+    Records, for one builder, a key for each part it generates alongside the
+    hashes of the files that part was last found to produce. The key covers
+    the part's configuration and the code of the modules which generate it,
+    so a part is only considered fresh when neither has changed and its files
+    are still exactly as they were.
+
+    The code of a module excludes its top-level `config` dict, so that
+    changing one entry of it only affects the parts built from that entry.
+
+    The cache lives in CACHE_NAME next to the output directory, shared by all
+    builders, each of which keeps its entries under its own section. Paths
+    are recorded relative to the cache.
+    """
+    def __init__(self, outpath, section, modules):
+        self.root = os.path.dirname(os.path.normpath(outpath))
+        self.path = os.path.join(self.root, CACHE_NAME)
+        self.section = section
+        self.sections = read_json(self.path)
+        if self.sections.get("_version") != CACHE_VERSION:
+            self.sections = {"_version": CACHE_VERSION}
+        self.codes = self.sections.setdefault(CODE_SECTION, {})
+        self.dirty = False
+        self.modules = hashlib.sha1()
+        for module in modules:
+            self.modules.update(self.code_hash(_module_file(module)).encode())
+        self.old = self.sections.get(section, {})
+        self.new = {}
+
+    def code_hash(self, path):
+        """
+        Return a hash of the code in the Python source file at `path`, other
+        than its `config` dict. As parsing the source is slow for the larger
+        builders, the result is cached against the hash of the whole file.
+        """
+        digest = file_hash(path)
+        name = os.path.basename(path)
+        cached = self.codes.get(name)
+        if cached is not None and cached[0] == digest:
+            return cached[1]
+        with open(path) as f:
+            tree = ast.parse(f.read())
+        tree.body = [node for node in tree.body if not _is_config(node)]
+        code = hashlib.sha1(ast.dump(tree).encode()).hexdigest()
+        self.codes[name] = [digest, code]
+        self.dirty = True
+        return code
+
+    def key(self, *parts):
+        """Return the cache key for a part described by `parts`."""
+        h = self.modules.copy()
+        h.update(json.dumps(parts, sort_keys=True, default=repr).encode())
+        return h.hexdigest()
+
+    def paths(self, key, incremental=False):
+        """
+        Return the list of output paths recorded for `key` if they are all
+        unchanged since they were recorded, or None otherwise.
+
+        Files are compared by their contents unless `incremental` is set, in
+        which case a file whose modification time and size are as recorded is
+        assumed to be unchanged without being read.
+        """
+        entry = self.old.get(key)
+        if entry is None:
+            return None
+        paths = []
+        fresh = []
+        for relpath, digest, stat in entry:
+            path = os.path.join(self.root, relpath)
+            current = file_stat(path)
+            if not (incremental and current == stat):
+                if file_hash(path) != digest:
+                    return None
+            paths.append(path)
+            fresh.append([relpath, digest, current])
+        self.new[key] = fresh
+        return paths
+
+    def update(self, key, *paths):
+        """Record that the part for `key` is up to date in `paths`."""
+        self.new[key] = [[os.path.relpath(path, self.root or "."),
+                          file_hash(path), file_stat(path)] for path in paths]
+
+    def save(self, prune=True):
+        """
+        Write the cache. With `prune`, entries for parts not seen this run are
+        dropped, so only pass it when every part was considered.
+        """
+        if not prune:
+            self.new = dict(self.old, **self.new)
+        if self.new == self.old and not self.dirty:
+            return
+        self.sections[self.section] = self.new
+        write_json(self.path, self.sections)
+
+
+class CheckCache:
+    """
+    Records, for one checker, the result of checking each file against the
+    hash of the file's contents and of the checker's rules, being the source
+    of the modules which implement them. A file need only be checked again
+    when either has changed.
+
+    The cache lives in CHECK_CACHE_NAME in `cache_dir()`, outside the tree,
+    and is shared by every checkout. Runs may overlap: saving merges in any
+    results written since this run started.
+    """
+    def __init__(self, section, modules):
+        self.path = os.path.join(cache_dir(), CHECK_CACHE_NAME)
+        self.section = section
+        sections = read_json(self.path)
+        if sections.get("_version") != CACHE_VERSION:
+            sections = {}
+        self.old = sections.get(section, {})
+        self.new = {}
+        self.rules = hashlib.sha1()
+        for module in modules:
+            self.rules.update(file_hash(_module_file(module)).encode())
+
+    def key(self, path, *parts):
+        """
+        Return the cache key for checking the file at `path`, whose result
+        also depends on `parts`, or None if it cannot be read.
+        """
+        digest = file_hash(path)
+        if digest is None:
+            return None
+        h = self.rules.copy()
+        h.update(json.dumps([digest, parts]).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Return the result recorded for `key`, or None."""
+        result = self.old.get(key)
+        if result is not None:
+            self.new[key] = result
+        return result
+
+    def set(self, key, result):
+        """Record `result` for `key`, which must be JSON serialisable."""
+        if key is not None:
+            self.new[key] = result
+
+    def save(self):
+        """
+        Write the cache, keeping the CHECK_CACHE_SIZE most recently used
+        results. As the cache is only an optimisation, failing to write it
+        is not an error.
+        """
+        if all(key in self.old for key in self.new):
+            return
+        sections = read_json(self.path)
+        if sections.get("_version") != CACHE_VERSION:
+            sections = {"_version": CACHE_VERSION}
+        results = sections.get(self.section, {})
+        for key in self.new:
+            results.pop(key, None)
+        results.update(self.new)
+        keys = list(results)[-CHECK_CACHE_SIZE:]
+        sections[self.section] = dict((key, results[key]) for key in keys)
+        try:
+            if not os.path.isdir(cache_dir()):
+                os.makedirs(cache_dir())
+            # Results are kept in the order they were last used
+            write_json(self.path, sections, sort_keys=False)
+        except (IOError, OSError):
+            pass
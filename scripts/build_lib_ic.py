@@ -1462,6 +1462,8 @@ config = {
 import os
 import sys
 
+from build_cache import BuildCache
+
 
 pin_types = {
     "in": "I",
@@ -1602,12 +1604,21 @@ def documentation(conf):
     return "\n".join(out)
 
 
-def main(libpath, verify=False):
+def main(libpath, verify=False, incremental=False):
+    cache = BuildCache(libpath, "build_lib_ic", (__name__,))
+    libkey = os.path.abspath(libpath)
     for name, conf in config.items():
         conf['name'] = name
         path = os.path.join(libpath, conf.get("path", ""), name.lower()+".lib")
         dcmpath = os.path.splitext(path)[0] + ".dcm"
 
+        # Skip parts which are unchanged since they were last built
+        key = cache.key(libkey, conf)
+        if cache.paths(key, incremental) is not None:
+            if verify:
+                print("Verifying", path)
+            continue
+
         lib = library(conf)
         dcm = documentation(conf)
 
@@ -1622,16 +1633,21 @@ def main(libpath, verify=False):
                 with open(dcmpath) as f:
                     olddcm = f.read()
                 if lib == oldlib and dcm == olddcm:
+                    cache.update(key, path, dcmpath)
                     continue
 
         # If so, either verification failed or write the new files
         if verify:
+            cache.save(prune=False)
             return False
         else:
             with open(path, "w") as f:
                 f.write(lib)
             with open(dcmpath, "w") as f:
                 f.write(dcm)
+            cache.update(key, path, dcmpath)
+
+    cache.save()
 
     # If we finished and didn't return yet, verification has succeeded
     if verify:
@@ -1642,14 +1658,16 @@ if __name__ == "__main__":
     if len(sys.argv) == 2:
         libpath = sys.argv[1]
         main(libpath)
-    elif len(sys.argv) == 3 and sys.argv[2] == "--verify":
+    elif sys.argv[2:] in (["--verify"], ["--verify", "--incremental"]):
         libpath = sys.argv[1]
-        if main(libpath, verify=True):
+        incremental = len(sys.argv) == 4
+        if main(libpath, verify=True, incremental=incremental):
             print("OK: all libs up-to-date.")
             sys.exit(0)
         else:
             print("Error: libs not up-to-date.", file=sys.stderr)
             sys.exit(1)
     else:
-        print("Usage: {} <lib path>".format(sys.argv[0]))
+        print("Usage: {} <lib path> [--verify [--incremental]]"
+              .format(sys.argv[0]))
         sys.exit(1)
@@ -480,14 +480,13 @@ font_halfheight = 0.7
 
 # End Constants ===============================================================
 
-import os
 import sys
 import time
 import math
-import subprocess
 
-from sexp import parse as sexp_parse, generate as sexp_generate
-from kicad_mod import fp_line, fp_arc, fp_circle, fp_text, pad, draw_square
+from sexp import generate as sexp_generate
+from kicad_mod import fp_line, fp_arc, fp_circle, fp_text, pad, draw_square, \
+    build_footprints
 
 
 def pin_centres(conf):
@@ -841,61 +840,34 @@ def footprint(conf):
     sexp += silk(conf)
     sexp += ctyd(conf)
     sexp += pads(conf)
-    return sexp_generate(sexp)
+    return conf['name'], sexp_generate(sexp)
 
 
-def git_version(libpath):
-    args = ["git", "describe", "--abbrev=8", "--dirty=-dirty", "--always"]
-    git = subprocess.Popen(args, cwd=libpath, stdout=subprocess.PIPE)
-    return git.stdout.read().decode().strip()
-
-
-def main(prettypath, verify=False):
+def main(prettypath, verify=False, incremental=False):
     for name, conf in config.items():
         conf['name'] = name
         assert conf['rows'] in (2, 4), \
             "Must have either two or four rows"
         assert conf['pins'] % conf['rows'] == 0, \
             "Pins must equally divide among rows"
-        fp = footprint(conf)
-        path = os.path.join(prettypath, name+".kicad_mod")
-
-        if verify:
-            print("Verifying", path)
-
-        # Check if an identical part already exists
-        if os.path.isfile(path):
-            with open(path) as f:
-                old = f.read()
-            old = [n for n in sexp_parse(old) if n[0] != "tedit"]
-            new = [n for n in sexp_parse(fp) if n[0] != "tedit"]
-            if new == old:
-                continue
-
-        # If not, either verification failed or we should output the new fp
-        if verify:
-            return False
-        else:
-            with open(path, "w") as f:
-                f.write(fp)
-
-    # If we finished and didn't return yet, verification has succeeded.
-    if verify:
-        return True
+    jobs = [(footprint, conf) for conf in config.values()]
+    return build_footprints(prettypath, jobs, verify, incremental)
 
 
 if __name__ == "__main__":
     if len(sys.argv) == 2:
         prettypath = sys.argv[1]
         main(prettypath)
-    elif len(sys.argv) == 3 and sys.argv[2] == "--verify":
+    elif sys.argv[2:] in (["--verify"], ["--verify", "--incremental"]):
         prettypath = sys.argv[1]
-        if main(prettypath, verify=True):
+        incremental = len(sys.argv) == 4
+        if main(prettypath, verify=True, incremental=incremental):
             print("OK: all footprints up-to-date.")
             sys.exit(0)
         else:
             print("Error: footprints not up-to-date.", file=sys.stderr)
             sys.exit(1)
     else:
-        print("Usage: {} <.pretty path> [--verify]".format(sys.argv[0]))
+        print("Usage: {} <.pretty path> [--verify [--incremental]]"
+              .format(sys.argv[0]))
         sys.exit(1)
@@ -39,13 +39,12 @@ font_halfheight = 0.7
 # End Settings ================================================================
 
 
-import os
 import sys
 import time
 import math
 
-from sexp import parse as sexp_parse, generate as sexp_generate
-from kicad_mod import fp_line, fp_text, pad, draw_square
+from sexp import generate as sexp_generate
+from kicad_mod import fp_line, fp_text, pad, draw_square, build_footprints
 
 
 def tfml_pads(pins):
@@ -220,48 +219,27 @@ def sfml_lc(pins):
     return name, sexp_generate(sexp)
 
 
-def main(prettypath, verify=False):
-    for pins in (5, 7, 10):
-        for generator in (tfml, tfml_lc, sfml, sfml_lc):
-            # Generate footprint
-            name, fp = generator(pins)
-            path = os.path.join(prettypath, name + ".kicad_mod")
-
-            if verify:
-                print("Verifying", path)
-
-            # Check if the file already exists and isn't changed
-            if os.path.isfile(path):
-                with open(path) as f:
-                    old = f.read()
-                old = [n for n in sexp_parse(old) if n[0] != "tedit"]
-                new = [n for n in sexp_parse(fp) if n[0] != "tedit"]
-                if new == old:
-                    continue
-
-            # If it needs changing, either verification failed or we rewrite
-            if verify:
-                return False
-            else:
-                with open(path, "w") as f:
-                    f.write(fp)
-
-    if verify:
-        return True
+def main(prettypath, verify=False, incremental=False):
+    generators = (tfml, tfml_lc, sfml, sfml_lc)
+    jobs = [(generator, pins)
+            for pins in (5, 7, 10) for generator in generators]
+    return build_footprints(prettypath, jobs, verify, incremental)
 
 
 if __name__ == "__main__":
     if len(sys.argv) == 2:
         prettypath = sys.argv[1]
         main(prettypath)
-    elif len(sys.argv) == 3 and sys.argv[2] == "--verify":
+    elif sys.argv[2:] in (["--verify"], ["--verify", "--incremental"]):
         prettypath = sys.argv[1]
-        if main(prettypath, verify=True):
+        incremental = len(sys.argv) == 4
+        if main(prettypath, verify=True, incremental=incremental):
             print("OK: all footprints up-to-date.")
             sys.exit(0)
         else:
             print("Error: footprints not up-to-date.", file=sys.stderr)
             sys.exit(1)
     else:
-        print("Usage: {} <.pretty path>".format(sys.argv[0]))
+        print("Usage: {} <.pretty path> [--verify [--incremental]]"
+              .format(sys.argv[0]))
         sys.exit(0)
@@ -10,48 +10,69 @@ from __future__ import print_function, division
 
 import sys
 import os
-import fnmatch
 import re
+from concurrent.futures import ProcessPoolExecutor
+
+import kicad_lib
+from compile_lib import libpaths
+from build_cache import CheckCache
+from footprint_index import FootprintIndex
+from check_report import RuleResults, FORMATS, FORMATTERS
 
 
 EXCLUSIONS = ("agg-kicad.lib", "conn.lib", "power.lib", "switch.lib")
 
 
-re_defs = re.compile("^DEF (?P<name>[^ ]*) (?P<des>[^ ]*) ", re.MULTILINE)
-re_pins = re.compile("^X (?P<name>[^ ]*) (?P<num>[^ ]*)"
-                     " (?P<x>[0-9\-]*) (?P<y>[0-9\-]*) (?P<len>[0-9]*)"
-                     " [A-Z] (?P<numsize>[0-9]*) (?P<namesize>[0-9]*)",
-                     re.MULTILINE)
-re_refn = re.compile("^F0 (?P<value>[^ ]*) (?P<x>[0-9\-]*) (?P<y>[0-9\-]*)"
-                     " (?P<size>[0-9]*) (?P<orient>[VH]) (?P<visible>[IV])"
-                     " (?P<hjust>[LRC]) (?P<vjust>[TBC]{1,3})", re.MULTILINE)
-re_name = re.compile("^F1 (?P<value>[^ ]*) (?P<x>[0-9\-]*) (?P<y>[0-9\-]*)"
-                     " (?P<size>[0-9]*) (?P<orient>[VH]) (?P<visible>[IV])"
-                     " (?P<hjust>[LRC]) (?P<vjust>[TBC]{1,3})", re.MULTILINE)
-re_fp = re.compile("^F2 (?P<value>[^ ]*) (?P<x>[0-9\-]*) (?P<y>[0-9\-]*)"
-                   " (?P<size>[0-9]*) (?P<orient>[VH]) (?P<visible>[IV])"
-                   " (?P<hjust>[LRC]) (?P<vjust>[TBC]{1,3})", re.MULTILINE)
-re_ds = re.compile("^F3 (?P<value>[^ ]*) (?P<x>[0-9\-]*) (?P<y>[0-9\-]*)"
-                   " (?P<size>[0-9]*) (?P<orient>[VH]) (?P<visible>[IV])"
-                   " (?P<hjust>[LRC]) (?P<vjust>[TBC]{1,3})", re.MULTILINE)
-re_oc = re.compile("^F[4-9] (?P<value>[^ ]*) (?P<x>[0-9\-]*) (?P<y>[0-9\-]*)"
-                   " (?P<size>[0-9]*) (?P<orient>[VH]) (?P<visible>[IV])"
-                   " (?P<hjust>[LRC]) (?P<vjust>[TBC]{1,3})", re.MULTILINE)
-re_poly = re.compile("^[SP] .* (?P<fill>[NfF])$", re.MULTILINE)
-
-
-def checkdefs(contents, libf, errs):
+# Field numbers from F4 onwards are order codes
+FIELD_NAMES = {0: "F0", 1: "F1", 2: "F2", 3: "F3"}
+
+# The start of a field line, to report those which could not be parsed
+re_field_start = re.compile("F[0-9]+ ")
+
+
+def tokenize(lib):
+    """
+    Collect the parts of the parsed Library `lib` which the rules look at.
+    Returns a dict mapping "DEF" to its symbols, "X" to their pins, each of
+    F0, F1, F2, F3 and F4 (for F4 onwards) to the matching fields, "fill" to
+    the fill of each S or P shape, "invisible" to the set of #invisible
+    options set, and "unparsed" to any field or pin lines not understood.
+    """
+    tokens = dict((name, []) for name in
+                  ("DEF", "X", "F0", "F1", "F2", "F3", "F4", "fill",
+                   "unparsed"))
+    tokens["invisible"] = set()
+    for symbol in lib.symbols:
+        tokens["DEF"].append(symbol)
+        for item in symbol.body:
+            if isinstance(item, kicad_lib.Pin):
+                tokens["X"].append(item)
+            elif isinstance(item, kicad_lib.Field):
+                tokens[FIELD_NAMES.get(item.number, "F4")].append(item)
+            elif isinstance(item, kicad_lib.Graphic):
+                if item.kind in ("S", "P"):
+                    tokens["fill"].append(item.fill)
+            elif item[:1] == "X" or re_field_start.match(item):
+                tokens["unparsed"].append(item)
+    for line in lib.comments:
+        for fn in ("reference", "name"):
+            if "#invisible" + fn in line:
+                tokens["invisible"].add(fn)
+    return tokens
+
+
+def checkdefs(tokens, libf, errs):
 
     # Check there's only one symbol in the library
-    n_defs = re_defs.findall(contents)
+    n_defs = tokens["DEF"]
     if len(n_defs) > 1:
         errs.append("Found more than one component in library")
     elif len(n_defs) == 0:
         errs.append("Did not find any components in library")
 
     # Check symbol name matches library name
-    partname = n_defs[0][0]
-    designator = n_defs[0][1]
+    partname = n_defs[0].name
+    designator = n_defs[0].reference
     libname = os.path.split(libf)[-1].split(".")[0]
     if partname.lower() != libname:
         errs.append("Part name '{}' does not match library name '{}'"
@@ -60,23 +81,29 @@ def checkdefs(contents, libf, errs):
     return partname, designator
 
 
-def checkpins(contents, designator, errs):
-    pins = re_pins.findall(contents)
+def checkpins(tokens, designator, errs):
     nums = set()
-    for name, num, x, y, length, numsize, namesize in pins:
+    for pin in tokens["X"]:
         # Check pins lie on 100mil grid
-        if int(x) % 100 != 0 or int(y) % 100 != 0:
-            errs.append("Pin '{}' not on 100mil grid".format(name))
+        if pin.x % 100 != 0 or pin.y % 100 != 0:
+            errs.append("Pin '{}' not on 100mil grid".format(pin.name))
         # Check pins in IC and U parts are 100mil long
-        if designator in ("IC", "U") and int(length) not in (100, 150):
+        if designator in ("IC", "U") and pin.length not in (100, 150):
             errs.append("Pin '{}' not 100 or 150mil long, but part is IC or U"
-                        .format(name))
+                        .format(pin.name))
         # Check pin text fields are 50mil sized
-        if int(namesize) != 50 or (int(numsize) != 50 and num.isdigit()):
-            errs.append("Pin '{}' font size not 50mil".format(name))
+        if pin.name_size != 50 or \
+                (pin.num_size != 50 and pin.num.isdigit()):
+            errs.append("Pin '{}' font size not 50mil".format(pin.name))
         # Collect numeric pins
-        if num.isdigit():
-            nums.add(int(num))
+        if pin.num.isdigit():
+            nums.add(int(pin.num))
+    # Pin lines which could not be parsed are reported by checklines, so
+    # count their numbers too rather than also reporting them as missing
+    for line in tokens["unparsed"]:
+        params = line.split()
+        if params[0] == "X" and len(params) > 2 and params[2].isdigit():
+            nums.add(int(params[2]))
 
     if nums:
         expected = set(range(min(nums), max(nums)+1))
@@ -85,75 +112,136 @@ def checkpins(contents, designator, errs):
             errs.append("Missing pins {}".format(", ".join(missing)))
 
 
-def checkboxes(contents, designator, errs):
+def checkboxes(tokens, designator, errs):
     if designator == "IC":
-        boxes = re_poly.findall(contents)
+        boxes = tokens["fill"]
         if "f" not in boxes:
             errs.append("No background-filled box/poly found, but part is IC")
 
 
-def checkfields(contents, errs, prettypath):
-    refn_f = re_refn.findall(contents)
-    name_f = re_name.findall(contents)
-    foot_f = re_fp.findall(contents)
-    data_f = re_ds.findall(contents)
-    code_f = re_oc.findall(contents)
+def checkfields(tokens, errs):
+    refn_f = tokens["F0"]
+    name_f = tokens["F1"]
+    foot_f = tokens["F2"]
+    data_f = tokens["F3"]
+    code_f = tokens["F4"]
 
     fields = ((refn_f, "reference"), (name_f, "name"), (foot_f, "footprint"),
               (data_f, "datasheet"), (code_f, "order code"))
 
-    for field, fn in fields:
-        for value, x, y, size, orient, visible, hjust, vjust in field:
+    for fields_f, fn in fields:
+        for field in fields_f:
             if fn in ("reference", "name"):
-                if visible != "V":
-                    if "#invisible{}".format(fn) not in contents:
+                if field.visible != "V":
+                    if fn not in tokens["invisible"]:
                         errs.append("Field {} not visible".format(fn))
             else:
-                if visible != "I":
+                if field.visible != "I":
                     errs.append("Field {} visible".format(fn))
-            if orient != "H":
+            if field.orient != "H":
                 errs.append("Field {} not horizontal".format(fn))
-            if size != "50":
+            if field.size != 50:
                 errs.append("Field {} font size not 50".format(fn))
 
-    refn_y = int(refn_f[0][2])
-    name_y = int(name_f[0][2])
+    for field, fn in fields[:3]:
+        if not field:
+            errs.append("Field {} missing".format(fn))
+    if not (refn_f and name_f and foot_f):
+        return
 
-    if refn_y <= name_y:
+    if refn_f[0].y <= name_f[0].y:
         errs.append("Component reference not above component name")
 
-    fp = foot_f[0][0][1:-1]
-    if fp.startswith("agg:"):
-        fp = fp.split(":")[1] + ".kicad_mod"
-        path = os.path.join(prettypath, fp)
-        if not os.path.exists(path):
-            errs.append("Component references non-existent footprint {}"
-                        .format(fp))
-
+    return foot_f[0].value
 
-def checklib(libf, prettypath):
-    errs = []
 
-    # Check if there's a corresponding .dcm file
+def checkdcm(libf, errs):
     dcmpath = ".".join(libf.split(".")[:-1]) + ".dcm"
     if not os.path.isfile(dcmpath):
         errs.append("No corresponding DCM found")
 
-    with open(libf) as f:
-        contents = f.read()
+
+def checkfootprint(fp, index, errs):
+    if fp is not None and index.exists(fp) is False:
+        errs.append("Component references non-existent footprint {}"
+                    .format(fp.split(":")[1] + ".kicad_mod"))
+
+
+def checklines(tokens, errs):
+    for line in tokens["unparsed"]:
+        errs.append("Could not parse line '{}'".format(line))
+
+
+def symerrors(libf, lib=None):
+    """
+    Check the library file `libf` against the rules which depend only on its
+    name and contents, using the Library `lib` already parsed from it if
+    given. Returns the RuleResults and the footprint the part references, if
+    any, as these results can be cached.
+    """
+    results = RuleResults()
+
+    if lib is None:
+        lib = kicad_lib.load(libf)
+
+    # Collect everything the following checks look at once
+    tokens = tokenize(lib)
+
+    # Check every field and pin line could be parsed
+    results.run(checklines, tokens)
 
     # Check there's only one symbol and its name matches the library file
-    partname, designator = checkdefs(contents, libf, errs)
+    partname, designator = results.run(checkdefs, tokens, libf)
 
     # Check pins
-    checkpins(contents, designator, errs)
+    results.run(checkpins, tokens, designator)
 
     # If part is an IC check at least one filled box/polyline is present
-    checkboxes(contents, designator, errs)
+    results.run(checkboxes, tokens, designator)
 
     # Check fields
-    checkfields(contents, errs, prettypath)
+    fp = results.run(checkfields, tokens)
+
+    return results, fp
+
+
+def footprints(prettypath, tables=()):
+    """
+    Return a FootprintIndex of the footprints in `prettypath`, as the agg
+    library, and in the libraries listed by each fp-lib-table in `tables`.
+    """
+    index = FootprintIndex()
+    for table in tables:
+        index.add_table(table)
+    index.add_pretty(prettypath, "agg")
+    return index
+
+
+def liberrors(libf, index, lib=None, result=None):
+    """
+    Return the RuleResults of checking the library file `libf`, checking
+    referenced footprints against the FootprintIndex `index`, and using the
+    Library `lib` already parsed from it if given, or the `result` of
+    `symerrors` for it if given.
+    """
+    results = RuleResults()
 
+    # Check if there's a corresponding .dcm file
+    results.run(checkdcm, libf)
+
+    if result is None:
+        result = symerrors(libf, lib)
+    sym_results, fp = result
+    results.add(sym_results)
+
+    # Check the referenced footprint exists, which is never cached as it
+    # depends on the footprint library rather than this file
+    results.run(checkfootprint, fp, index)
+
+    return results
+
+
+def report(libf, errs):
     if len(errs) == 0:
         print("Checked '{}': OK".format(libf))
         return True
@@ -165,30 +253,95 @@ def checklib(libf, prettypath):
         return False
 
 
-def main(libpath, prettypath):
+def checklib(libf, prettypath, lib=None):
+    return report(libf, liberrors(libf, footprints(prettypath), lib).messages)
+
+
+def main(libpath, prettypath, jobs=1, tables=(), fmt="text"):
+    """
+    Check every library in `libpath`.
+
+    Referenced footprints are looked up in `prettypath` for the agg library
+    and in the libraries listed by each fp-lib-table file in `tables`, each
+    directory being listed once. Footprints in other libraries are not
+    checked.
+
+    Libraries whose contents and rules are unchanged since they were last
+    checked reuse the recorded result, see `build_cache.CheckCache`. With
+    `jobs` greater than one, the other libraries are checked in that many
+    worker processes, and the results reported in the same order once all
+    are done.
+
+    The report is printed as text, or with `fmt` as "json" or "junit" in that
+    format, see `check_report`.
+    """
+    paths = list(libpaths(libpath))
+    cache = CheckCache("check_lib", (__name__, "kicad_lib"))
+    keys = {}
+    results = {}
+    for path in paths:
+        if os.path.basename(path) not in EXCLUSIONS:
+            keys[path] = cache.key(path, os.path.basename(path))
+            result = cache.get(keys[path])
+            if result is not None:
+                errors, fp, times = result
+                results[path] = (RuleResults(errors, times, cached=True), fp)
+    checks = [path for path in keys if path not in results]
+    if jobs > 1:
+        chunksize = max(1, len(checks) // (jobs * 4))
+        with ProcessPoolExecutor(jobs) as pool:
+            new = list(pool.map(symerrors, checks, chunksize=chunksize))
+    else:
+        new = map(symerrors, checks)
+    for path, (sym_results, fp) in zip(checks, new):
+        cache.set(keys[path], [sym_results.errors, fp, sym_results.times])
+        results[path] = (sym_results, fp)
+    cache.save()
+    index = footprints(prettypath, tables)
+    files = []
+    for path in paths:
+        if path in results:
+            files.append((path, liberrors(path, index, result=results[path])))
+        else:
+            files.append((path, None))
+    if fmt != "text":
+        print(FORMATTERS[fmt]("check_lib", files))
+        return not any(file_results and file_results.errors
+                       for path, file_results in files)
     ok = True
-    for dirpath, dirnames, files in os.walk(libpath):
-        dirnames.sort()
-        files.sort()
-        for f in fnmatch.filter(files, "*.lib"):
-            path = os.path.join(dirpath, f)
-            if f not in EXCLUSIONS:
-                result = checklib(path, prettypath)
-                if not result:
-                    ok = False
-            else:
-                print("Skipping '{}'".format(path))
+    for path, file_results in files:
+        if file_results is None:
+            print("Skipping '{}'".format(path))
+        elif not report(path, file_results.messages):
+            ok = False
     return ok
 
+
+def usage():
+    print("Usage: {} <lib path> <prettypath> [--jobs N] "
+          "[--fp-lib-table <file>]... [--format text|json|junit]"
+          .format(sys.argv[0]))
+    sys.exit(1)
+
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: {} <lib path> <prettypath>".format(sys.argv[0]))
-        sys.exit(1)
-    else:
-        libpath = sys.argv[1]
-        prettypath = sys.argv[2]
-        success = main(libpath, prettypath)
-        if success:
-            sys.exit(0)
+    if len(sys.argv) < 3 or len(sys.argv) % 2 == 0:
+        usage()
+    libpath = sys.argv[1]
+    prettypath = sys.argv[2]
+    jobs = 1
+    tables = []
+    fmt = "text"
+    for flag, value in zip(sys.argv[3::2], sys.argv[4::2]):
+        if flag == "--jobs" and value.isdigit():
+            jobs = int(value)
+        elif flag == "--fp-lib-table":
+            tables.append(value)
+        elif flag == "--format" and value in FORMATS:
+            fmt = value
         else:
-            sys.exit(1)
+            usage()
+    success = main(libpath, prettypath, jobs=jobs, tables=tables, fmt=fmt)
+    if success:
+        sys.exit(0)
+    else:
+        sys.exit(1)
@@ -12,15 +12,17 @@ import sys
 import os
 import glob
 from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
 
-from sexp import parse as sexp_parse
+from sexp import load as sexp_load, find as sexp_find, select, select_one, \
+    to_decimal
+from build_cache import CheckCache
+from check_report import RuleResults, FORMATS, FORMATTERS
 
 
 def checkrefval(mod, errs):
-    for fp_text in (node for node in mod if node[0] == "fp_text"):
-        if fp_text[1] not in ("reference", "value"):
-            continue
-        layer = [n for n in fp_text if n[0] == "layer"][0]
+    for fp_text in select(mod, "fp_text[1=reference|value]"):
+        layer = sexp_find(fp_text, "layer")
         if layer[1] != "F.Fab":
             errs.append("Value and Reference fields must be on F.Fab")
         if fp_text[1] == "reference" and fp_text[2] != "REF**":
@@ -30,60 +32,55 @@ def checkrefval(mod, errs):
 
 
 def checkfont(mod, errs):
-    for fp_text in (node for node in mod if node[0] == "fp_text"):
-        effects = [n for n in fp_text if n[0] == "effects"][0]
-        font = [n for n in effects if n[0] == "font"][0]
-        size = [n for n in font if n[0] == "size"][0]
-        thickness = [n for n in font if n[0] == "thickness"][0]
-        if (Decimal(size[1]) != 1 or Decimal(size[2]) != 1):
+    for fp_text in select(mod, "fp_text"):
+        size = select_one(fp_text, "effects/font/size")
+        thickness = select_one(fp_text, "effects/font/thickness")
+        if (to_decimal(size[1]) != 1 or to_decimal(size[2]) != 1):
             errs.append("Font must all be 1mm x 1mm size")
-        if Decimal(thickness[1]) != Decimal("0.15"):
+        if to_decimal(thickness[1]) != Decimal("0.15"):
             errs.append("Font must be 0.15mm line thickness")
 
 
 def checksilk(mod, errs):
-    silk_types = ("fp_line", "fp_circle", "fp_arc", "fp_poly", "fp_curve")
-    for silk in (node for node in mod if node[0] in silk_types):
-        layer = [n for n in silk if n[0] == "layer"][0]
-        width = [n for n in silk if n[0] == "width"][0]
-        silk_layers = ("F.SilkS", "B.SilkS")
-        if layer[1] in silk_layers:
-            if Decimal(width[1]) != Decimal("0.15"):
-                errs.append("Silk lines must be 0.15mm wide")
+    silk = "fp_line|fp_circle|fp_arc|fp_poly|fp_curve[layer=F.SilkS|B.SilkS]"
+    for width in select(mod, silk + "/width"):
+        if to_decimal(width[1]) != Decimal("0.15"):
+            errs.append("Silk lines must be 0.15mm wide")
 
 
 def checkctyd(mod, errs):
     found_ctyd = False
-    for ctyd in (node for node in mod if node[0] == "fp_line"):
-        layer = [n for n in ctyd if n[0] == "layer"][0]
-        width = [n for n in ctyd if n[0] == "width"][0]
-        start = [n for n in ctyd if n[0] == "start"][0]
-        end = [n for n in ctyd if n[0] == "end"][0]
-        ctyd_layers = ("F.CrtYd", "B.CrtYd")
-        if layer[1] in ctyd_layers:
-            found_ctyd = True
-            if Decimal(width[1]) != Decimal("0.01"):
-                errs.append("Courtyard lines must be 0.01mm wide")
-            if (Decimal(start[1]) % Decimal("0.05") != 0
-                    or Decimal(start[2]) % Decimal("0.05") != 0
-                    or Decimal(end[1]) % Decimal("0.05") != 0
-                    or Decimal(end[2]) % Decimal("0.05") != 0):
-                errs.append("Courtyard lines must lie on a 0.05mm grid")
+    for ctyd in select(mod, "fp_line[layer=F.CrtYd|B.CrtYd]"):
+        width = sexp_find(ctyd, "width")
+        start = sexp_find(ctyd, "start")
+        end = sexp_find(ctyd, "end")
+        found_ctyd = True
+        if to_decimal(width[1]) != Decimal("0.01"):
+            errs.append("Courtyard lines must be 0.01mm wide")
+        if (to_decimal(start[1]) % Decimal("0.05") != 0
+                or to_decimal(start[2]) % Decimal("0.05") != 0
+                or to_decimal(end[1]) % Decimal("0.05") != 0
+                or to_decimal(end[2]) % Decimal("0.05") != 0):
+            errs.append("Courtyard lines must lie on a 0.05mm grid")
     if not found_ctyd:
         errs.append("No courtyard found")
 
 
-def checkmod(path):
-    errs = []
+def moderrors(path):
+    """Return the RuleResults of checking the footprint file `path`."""
+    results = RuleResults()
+
+    mod = sexp_load(path, nodes=True)
+
+    results.run(checkrefval, mod)
+    results.run(checkfont, mod)
+    results.run(checksilk, mod)
+    results.run(checkctyd, mod)
 
-    with open(path) as f:
-        mod = sexp_parse(f.read())
+    return results
 
-    checkrefval(mod, errs)
-    checkfont(mod, errs)
-    checksilk(mod, errs)
-    checkctyd(mod, errs)
 
+def report(path, errs):
     if len(errs) == 0:
         print("Checked '{}': OK".format(path))
         return True
@@ -95,23 +92,72 @@ def checkmod(path):
         return False
 
 
-def main(libpath):
+def checkmod(path):
+    return report(path, moderrors(path).messages)
+
+
+def main(libpath, jobs=1, fmt="text"):
+    """
+    Check every footprint in `libpath`. Footprints whose contents and rules
+    are unchanged since they were last checked reuse the recorded result,
+    see `build_cache.CheckCache`. With `jobs` greater than one, the other
+    footprints are checked in that many worker processes, and the results
+    reported in the same order once all are done.
+
+    The report is printed as text, or with `fmt` as "json" or "junit" in that
+    format, see `check_report`.
+    """
+    paths = glob.glob(os.path.join(libpath, "*.kicad_mod"))
+    cache = CheckCache("check_mod", (__name__, "sexp"))
+    keys = dict((path, cache.key(path)) for path in paths)
+    results = {}
+    for path in paths:
+        result = cache.get(keys[path])
+        if result is not None:
+            errors, times = result
+            results[path] = RuleResults(errors, times, cached=True)
+    checks = [path for path in paths if path not in results]
+    if jobs > 1:
+        chunksize = max(1, len(checks) // (jobs * 4))
+        with ProcessPoolExecutor(jobs) as pool:
+            new = list(pool.map(moderrors, checks, chunksize=chunksize))
+    else:
+        new = map(moderrors, checks)
+    for path, mod_results in zip(checks, new):
+        cache.set(keys[path], [mod_results.errors, mod_results.times])
+        results[path] = mod_results
+    cache.save()
+    files = [(path, results[path]) for path in paths]
+    if fmt != "text":
+        print(FORMATTERS[fmt]("check_mod", files))
+        return not any(file_results.errors for path, file_results in files)
     ok = True
-    for f in glob.glob(os.path.join(libpath, "*.kicad_mod")):
-        result = checkmod(f)
-        if not result:
+    for path, file_results in files:
+        if not report(path, file_results.messages):
             ok = False
     return ok
 
 
+def usage():
+    print("Usage: {} <.pretty path> [--jobs N] [--format text|json|junit]"
+          .format(sys.argv[0]))
+    sys.exit(1)
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: {} <.pretty path>".format(sys.argv[0]))
-        sys.exit(1)
-    else:
-        libpath = sys.argv[1]
-        success = main(libpath)
-        if success:
-            sys.exit(0)
+    if len(sys.argv) < 2 or len(sys.argv) % 2 != 0:
+        usage()
+    libpath = sys.argv[1]
+    jobs = 1
+    fmt = "text"
+    for flag, value in zip(sys.argv[2::2], sys.argv[3::2]):
+        if flag == "--jobs" and value.isdigit():
+            jobs = int(value)
+        elif flag == "--format" and value in FORMATS:
+            fmt = value
         else:
-            sys.exit(1)
+            usage()
+    success = main(libpath, jobs, fmt)
+    if success:
+        sys.exit(0)
+    else:
+        sys.exit(1)
@@ -0,0 +1,133 @@
+"""
+check_report.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Record the errors each rule of a checker finds in a file and the time spent
+in each rule, and report the results for every file as JSON or JUnit XML.
+"""
+
+from __future__ import print_function, division
+
+import json
+import time
+import xml.etree.ElementTree as ET
+
+FORMATS = ("text", "json", "junit")
+
+
+class RuleResults:
+    """
+    The errors found in one file, as [rule, message] pairs, and the seconds
+    spent in each rule. `cached` is set when the results were recorded by an
+    earlier run, in which case no rules were run and the times are those the
+    rules took in that run.
+    """
+    def __init__(self, errors=(), times=None, cached=False):
+        self.errors = [list(error) for error in errors]
+        self.times = dict(times or {})
+        self.cached = cached
+
+    def run(self, rule, *args):
+        """
+        Call `rule` with `args` and a list for it to append errors to,
+        recording those errors and the time taken against the rule's name.
+        Returns whatever the rule returns.
+        """
+        errs = []
+        t0 = time.perf_counter()
+        result = rule(*(args + (errs,)))
+        name = rule.__name__
+        self.times[name] = self.times.get(name, 0) + time.perf_counter() - t0
+        self.errors += [[name, err] for err in errs]
+        return result
+
+    def add(self, other):
+        """Add the errors and times of the RuleResults `other`."""
+        self.errors += other.errors
+        for name, t in other.times.items():
+            self.times[name] = self.times.get(name, 0) + t
+        self.cached = self.cached or other.cached
+
+    @property
+    def messages(self):
+        return [message for rule, message in self.errors]
+
+
+def rule_times(files):
+    """Return the total time spent in each rule over all `files`."""
+    times = {}
+    for path, results in files:
+        if results is not None:
+            for name, t in results.times.items():
+                times[name] = times.get(name, 0) + t
+    return times
+
+
+def format_json(checker, files):
+    """
+    Return a JSON report for `checker` of `files`, a list of (path,
+    RuleResults) pairs in which skipped files have None for their results.
+    """
+    report = {"checker": checker, "files": [],
+              "rules": rule_times(files)}
+    for path, results in files:
+        if results is None:
+            report["files"].append({"path": path, "status": "skipped"})
+            continue
+        report["files"].append({
+            "path": path,
+            "status": "error" if results.errors else "ok",
+            "cached": results.cached,
+            "errors": [{"rule": rule, "message": message}
+                       for rule, message in results.errors],
+            "times": results.times,
+        })
+    return json.dumps(report, indent=1, sort_keys=True)
+
+
+def format_junit(checker, files):
+    """
+    Return a JUnit XML report for `checker` of `files`, as for
+    `format_json`, with one test case per file. The total time spent in each
+    rule is given as a property of the test suite, as is the time recorded
+    for each file whose results were cached, named "cached." and its path.
+    """
+    times = rule_times(files)
+    failures = sum(1 for path, results in files if results and results.errors)
+    skipped = sum(1 for path, results in files if results is None)
+    suites = ET.Element("testsuites")
+    suite = ET.SubElement(suites, "testsuite", {
+        "name": checker, "tests": str(len(files)),
+        "failures": str(failures), "errors": "0", "skipped": str(skipped),
+        "time": "{:.6f}".format(sum(times.values()))})
+    properties = ET.SubElement(suite, "properties")
+    for name in sorted(times):
+        ET.SubElement(properties, "property", {
+            "name": "time." + name, "value": "{:.6f}".format(times[name])})
+    for path, results in files:
+        if results is not None and results.cached:
+            ET.SubElement(properties, "property", {
+                "name": "cached." + path,
+                "value": "{:.6f}".format(sum(results.times.values()))})
+    for path, results in files:
+        case = ET.SubElement(suite, "testcase", {
+            "classname": checker, "name": path})
+        if results is None:
+            ET.SubElement(case, "skipped")
+            continue
+        case.set("time", "{:.6f}".format(sum(results.times.values())))
+        if results.errors:
+            rules = []
+            for rule, message in results.errors:
+                if rule not in rules:
+                    rules.append(rule)
+            failure = ET.SubElement(case, "failure", {
+                "message": "Failed {}".format(", ".join(rules)),
+                "type": "CheckError"})
+            failure.text = "\n".join("{}: {}".format(rule, message)
+                                     for rule, message in results.errors)
+    return ET.tostring(suites, encoding="unicode")
+
+
+FORMATTERS = {"json": format_json, "junit": format_junit}
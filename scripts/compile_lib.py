@@ -5,10 +5,18 @@ Licensed under the MIT licence, see LICENSE file for details.
 
 Build a single KiCAD component library from multiple input libraries.
 
-Usage: compile_lib.py <lib path> <outfile> [--verify]
-
-With --verify, checks that <outfile> matches the library that would be
-generated, exits with 0 if match and 1 otherwise.
+Usage: compile_lib.py <lib path> <outfile> [--verify [--incremental]]
+
+Each input library's section of <outfile> starts with a marker giving its
+path, the SHA1 of its contents, the SHA1 of the section's lines and the
+version of the format sections are compiled in. When <outfile> already
+exists, sections whose library and lines are unchanged, in the current
+format, are copied from it rather than regenerated.
+
+With --verify, checks that the markers in <outfile> match the libraries that
+would be compiled and the lines of each section, exits with 0 if match and 1
+otherwise. With --incremental as well, the check is skipped if no input
+library has changed since it last passed.
 """
 
 from __future__ import print_function, division
@@ -16,78 +24,224 @@ from __future__ import print_function, division
 import sys
 import os
 import fnmatch
+import hashlib
 import datetime
-import subprocess
 
+import kicad_lib
+from git_version import git_version
+from build_cache import BuildCache, file_hash, file_stat
 
-def git_version(libpath):
-    # Handle running inside a git hook where the presence of these environment
-    # variables will cause problems
-    env = os.environ.copy()
-    if 'GIT_DIR' in env:
-        del env['GIT_DIR']
-    if 'GIT_INDEX_FILE' in env:
-        del env['GIT_INDEX_FILE']
+# Starts the section of each library in the compiled library, followed by the
+# library's path within the library directory, the SHA1 of its contents, the
+# SHA1 of the section's lines after the marker and FORMAT_VERSION
+SECTION_MARKER = "# agg-kicad source "
 
-    args = ["git", "describe", "--abbrev=8", "--dirty=-dirty", "--always"]
-    git = subprocess.Popen(args, cwd=libpath, env=env, stdout=subprocess.PIPE)
-    return git.stdout.read().decode().strip()
+# Bump when the lines compiled from a library change, to regenerate every
+# section
+FORMAT_VERSION = "1"
 
+END_MARKER = "# End of library\n"
 
-def writelib(libpath, outpath):
-    newlib = compilelib(libpath)
-    with open(outpath, "w") as f:
-        f.write(newlib)
 
+def libpaths(libpath):
+    """Yield the path of each .lib file in `libpath`, in sorted order."""
+    for dirpath, dirnames, files in os.walk(libpath):
+        dirnames.sort()
+        for f in fnmatch.filter(sorted(files), "*.lib"):
+            yield os.path.join(dirpath, f)
 
-def checklib(libpath, outpath):
-    with open(outpath) as f:
-        old = f.read().split("\n")
-        new = compilelib(libpath).split("\n")
-        # Don't compare the date or git commit strings
-        old[5] = old[6] = new[5] = new[6] = None
-        return old == new
 
+def sources(libpath, outpath=None):
+    """
+    Yield the path of each library in `libpath` to compile into `outpath`,
+    and its path relative to `libpath`, which is how its section is marked.
+    """
+    for path in libpaths(libpath):
+        if outpath is None or \
+                os.path.abspath(path) != os.path.abspath(outpath):
+            yield path, os.path.relpath(path, libpath).replace(os.sep, "/")
 
-def compilelib(libpath):
-    version = git_version(libpath)
-    lines = []
-    lines.append("EESchema-LIBRARY Version 2.3\n")
-    lines.append("#encoding utf-8\n\n")
-    lines.append("#" + "="*78 + "\n")
-    lines.append("# Automatically generated by agg-kicad compile_lib.py\n")
-    lines.append("# on {}\n".format(datetime.datetime.now()))
-    lines.append("# using git version {}\n".format(version))
-    lines.append("# See github.com/adamgreig/agg-kicad\n")
-    lines.append("#" + "="*78 + "\n\n")
 
-    for dirpath, dirnames, files in os.walk(libpath):
-        dirnames.sort()
-        for f in fnmatch.filter(sorted(files), "*.lib"):
-            with open(os.path.join(dirpath, f)) as libf:
-                part = libf.readlines()[2:-1]
-                if len(part) > 2 and "agg-kicad compile_lib.py" not in part[2]:
-                    lines.append("".join(part))
+def body_hash(lines):
+    """Return the SHA1 of the section `lines`."""
+    h = hashlib.sha1()
+    for line in lines:
+        h.update(line.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _marker(line):
+    """
+    Return the path, library hash, body hash and format version from the
+    section marker `line`, with None for any which are missing.
+    """
+    fields = line[len(SECTION_MARKER):].rstrip("\n").rsplit(" ", 3)
+    if len(fields) != 4:
+        return fields[0], None, None, None
+    return tuple(fields)
 
-    lines.append("# End of library\n")
 
-    return "".join(lines)
+def writelib(libpath, outpath):
+    """
+    Write the library compiled from `libpath` to `outpath` as it is
+    generated, copying the sections of unchanged libraries from `outpath` if
+    it exists. The file is replaced once complete.
+    """
+    tmppath = outpath + ".tmp"
+    try:
+        with open(tmppath, "w") as f:
+            if os.path.isfile(outpath):
+                with open(outpath) as old:
+                    f.writelines(iterlib(libpath, outpath, old))
+            else:
+                f.writelines(iterlib(libpath, outpath))
+        os.replace(tmppath, outpath)
+    except Exception:
+        os.remove(tmppath)
+        raise
+
+
+def checklib(libpath, outpath, incremental=False):
+    """
+    Check `outpath` is up-to-date with the libraries in `libpath`, comparing
+    the path and hash in each of its section markers with the libraries',
+    and the hash of each section's lines and FORMAT_VERSION with the others
+    the marker records. With `incremental`, skip the check if no library
+    has been added, removed or modified since `outpath` was last found to be
+    up-to-date.
+    """
+    if incremental:
+        cache = BuildCache(outpath, "compile_lib", (__name__,))
+        stats = [[path, file_stat(path)] for path in libpaths(libpath)]
+        key = cache.key(os.path.abspath(outpath), stats)
+        if cache.paths(key, incremental) is not None:
+            cache.save()
+            return True
+
+    markers = []
+    same = True
+    body = None
+    line = None
+    with open(outpath) as f:
+        for line in f:
+            if line.startswith(SECTION_MARKER) or line == END_MARKER:
+                if body is not None and body.hexdigest() != marker[2]:
+                    same = False
+                body = None
+                if line != END_MARKER:
+                    marker = _marker(line)
+                    markers.append(marker[:2])
+                    same = same and marker[3] == FORMAT_VERSION
+                    body = hashlib.sha1()
+            elif body is not None:
+                body.update(line.encode("utf-8"))
+    expected = [(relpath, file_hash(path))
+                for path, relpath in sources(libpath, outpath)]
+    same = same and markers == expected and line == END_MARKER
+
+    if incremental and same:
+        cache.update(key, outpath)
+        cache.save()
+    return same
+
+
+def _part(path):
+    """
+    Return the lines of the library at `path` between its header and footer,
+    as parsed by `kicad_lib`, or none if it has at most two lines there or is
+    itself a compiled library.
+    """
+    with open(path) as f:
+        lib = kicad_lib.parse(f.read())
+    lines = [line + "\n" for line in lib.item_lines()]
+    if len(lines) > 2 and "agg-kicad compile_lib.py" not in lines[2]:
+        return lines
+    return []
+
+
+def _sections(f):
+    """
+    Yield the path, library hash, body hash and format version from the
+    marker of each section of the compiled library open as `f`, followed by
+    the list of the section's lines, reading a section at a time.
+    """
+    section = None
+    for line in f:
+        if line.startswith(SECTION_MARKER) or line == END_MARKER:
+            if section is not None:
+                yield section
+            if line == END_MARKER:
+                return
+            section = _marker(line) + ([],)
+        elif section is not None:
+            section[4].append(line)
+
+
+def iterlib(libpath, outpath=None, old=None):
+    """
+    Yield each line of the library compiled from every library in `libpath`
+    other than `outpath`, parsing each in turn with `kicad_lib`.
+
+    If `old` is given, it is the previously compiled library open for
+    reading, from which the sections of unchanged libraries are copied,
+    provided their lines are intact and they are in the current format.
+    Sections are generated in full before being yielded, so that their
+    marker can record the hash of their lines.
+    """
+    version = git_version(libpath)
+    yield "EESchema-LIBRARY Version 2.3\n"
+    yield "#encoding utf-8\n"
+    yield "\n"
+    yield "#" + "="*78 + "\n"
+    yield "# Automatically generated by agg-kicad compile_lib.py\n"
+    yield "# on {}\n".format(datetime.datetime.now())
+    yield "# using git version {}\n".format(version)
+    yield "# See github.com/adamgreig/agg-kicad\n"
+    yield "#" + "="*78 + "\n"
+    yield "\n"
+
+    paths = list(sources(libpath, outpath))
+    order = dict((relpath, n) for n, (path, relpath) in enumerate(paths))
+    old_sections = _sections(old) if old is not None else iter(())
+    section = next(old_sections, None)
+
+    for n, (path, relpath) in enumerate(paths):
+        digest = file_hash(path)
+
+        # Skip sections of libraries which came earlier or no longer exist
+        while section is not None and order.get(section[0], -1) < n:
+            section = next(old_sections, None)
+
+        if section is not None and section[:2] == (relpath, digest) and \
+                section[3] == FORMAT_VERSION and \
+                body_hash(section[4]) == section[2]:
+            lines = section[4]
+        else:
+            lines = _part(path)
+        yield SECTION_MARKER + "{} {} {} {}\n".format(
+            relpath, digest, body_hash(lines), FORMAT_VERSION)
+        for line in lines:
+            yield line
+
+    yield END_MARKER
 
 
 def usage():
-    print("Usage: {} <lib path> <outfile> [--verify]".format(sys.argv[0]))
+    print("Usage: {} <lib path> <outfile> [--verify [--incremental]]"
+          .format(sys.argv[0]))
     sys.exit(1)
 
 if __name__ == "__main__":
-    if len(sys.argv) not in (3, 4):
+    if len(sys.argv) not in (3, 4, 5):
         usage()
     else:
         libpath = sys.argv[1]
         outpath = sys.argv[2]
         if len(sys.argv) == 3:
             writelib(libpath, outpath)
-        elif len(sys.argv) == 4 and sys.argv[3] == "--verify":
-            if checklib(libpath, outpath):
+        elif sys.argv[3:] in (["--verify"], ["--verify", "--incremental"]):
+            incremental = len(sys.argv) == 5
+            if checklib(libpath, outpath, incremental=incremental):
                 print("OK: '{}' is up-to-date with '{}'."
                       .format(outpath, libpath))
                 sys.exit(0)
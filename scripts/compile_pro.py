@@ -10,9 +10,11 @@ directory and otherwise empty.
 from __future__ import print_function, division
 import sys
 import os
-import fnmatch
 import datetime
 
+from compile_lib import libpaths
+from build_cache import BuildCache
+
 tpl = """update={date}
 version=1
 last_client=kicad
@@ -47,41 +49,64 @@ LibDir=
 """
 
 
-def makeprj(libpath):
+def makeprj(libpath, libs=None):
+    """
+    Make a project listing every library in `libpath`, or in `libs` if given,
+    a sequence of library file paths in sorted order.
+    """
+    if libs is None:
+        libs = libpaths(libpath)
     prj = tpl.format(
         date=datetime.datetime.utcnow().strftime("%a %d %b %Y %H:%M:%S GMT"))
     count = 1
-    for dirpath, dirnames, files in os.walk(libpath):
-        dirnames.sort()
-        for f in fnmatch.filter(sorted(files), "*.lib"):
-            path = os.path.join(dirpath, os.path.splitext(f)[0])
-            path = path.replace("\\", "/")
-            prj += "LibName{}={}\n".format(count, path)
-            count += 1
+    for path in libs:
+        path = os.path.splitext(path)[0]
+        path = path.replace("\\", "/")
+        prj += "LibName{}={}\n".format(count, path)
+        count += 1
     return prj
 
 
-def writeprj(libpath, prjpath):
-    prj = makeprj(libpath)
+def writeprj(libpath, prjpath, libs=None):
+    prj = makeprj(libpath, libs)
     with open(prjpath, "w") as f:
         f.write(prj)
 
 
-def checkprj(libpath, prjpath):
-    prj = makeprj(libpath).splitlines()
+def checkprj(libpath, prjpath, libs=None, incremental=False):
+    """
+    Check `prjpath` is up-to-date with the libraries in `libpath`. With
+    `incremental`, skip the check if no library has been added or removed
+    since `prjpath` was last found to be up-to-date.
+    """
+    if incremental:
+        cache = BuildCache(prjpath, "compile_pro", (__name__,))
+        if libs is None:
+            libs = list(libpaths(libpath))
+        key = cache.key(os.path.abspath(prjpath), list(libs))
+        if cache.paths(key, incremental) is not None:
+            cache.save()
+            return True
+
+    prj = makeprj(libpath, libs).splitlines()
     with open(prjpath, "r") as f:
         oldprj = f.read().splitlines()
+
+    if incremental and prj[1:] == oldprj[1:]:
+        cache.update(key, prjpath)
+        cache.save()
     return prj[1:] == oldprj[1:]
 
 
 if __name__ == "__main__":
-    if len(sys.argv) in (3, 4):
+    if len(sys.argv) in (3, 4, 5):
         libpath = sys.argv[1]
         prjpath = sys.argv[2]
         if len(sys.argv) == 3:
             writeprj(libpath, prjpath)
-        elif len(sys.argv) == 4 and sys.argv[3] == "--verify":
-            if checkprj(libpath, prjpath):
+        elif sys.argv[3:] in (["--verify"], ["--verify", "--incremental"]):
+            incremental = len(sys.argv) == 5
+            if checkprj(libpath, prjpath, incremental=incremental):
                 print("OK: '{}' is up-to-date with '{}'."
                       .format(prjpath, libpath))
                 sys.exit(0)
@@ -92,6 +117,7 @@ if __name__ == "__main__":
                       file=sys.stderr)
                 sys.exit(1)
     else:
-        print("Usage: {} <lib dir path> <.pro file path> [--verify]"
+        print("Usage: {} <lib dir path> <.pro file path> "
+              "[--verify [--incremental]]"
               .format(sys.argv[0]))
         sys.exit(1)
@@ -12,7 +12,8 @@ import sys
 import math
 import cairo
 
-from sexp import parse as sexp_parse
+from sexp import load as sexp_load, find as sexp_find, \
+    find_all as sexp_find_all, select, to_float
 
 # Settings ====================================================================
 
@@ -51,18 +52,13 @@ def find_size(mod):
     """
     left = right = top = bottom = 0
 
-    for line in (n for n in mod if n[0] == "fp_line"):
-        layer = [n for n in line if n[0] == "layer"][0]
-        if layer[1] in ("F.CrtYd", "B.CrtYd"):
-            start = [n for n in line if n[0] == "start"][0]
-            end = [n for n in line if n[0] == "end"][0]
-            for x, y in (start[1:], end[1:]):
-                x = float(x)
-                y = float(y)
-                left = min(x, left)
-                right = max(x, right)
-                top = min(y, top)
-                bottom = max(y, bottom)
+    for point in select(mod, "fp_line[layer=F.CrtYd|B.CrtYd]/start|end"):
+        x = to_float(point[1])
+        y = to_float(point[2])
+        left = min(x, left)
+        right = max(x, right)
+        top = min(y, top)
+        bottom = max(y, bottom)
 
     width = right - left
     height = bottom - top
@@ -76,38 +72,38 @@ def find_size(mod):
 
 
 def draw_line(ctxs, draw):
-    layer = [n for n in draw if n[0] == "layer"][0][1]
+    layer = sexp_find(draw, "layer")[1]
     if layer in ctxs:
         ctx = ctxs[layer]
         rgba = colours[layer]
-        width = [n for n in draw if n[0] == "width"][0][1]
+        width = sexp_find(draw, "width")[1]
         ctx.set_source_rgba(*rgba)
-        ctx.set_line_width(float(width))
+        ctx.set_line_width(to_float(width))
         ctx.set_line_cap(cairo.LINE_CAP_ROUND)
         if draw[0] == "fp_line":
-            start = [n for n in draw if n[0] == "start"][0]
-            end = [n for n in draw if n[0] == "end"][0]
-            ctx.move_to(float(start[1]), float(start[2]))
-            ctx.line_to(float(end[1]), float(end[2]))
+            start = sexp_find(draw, "start")
+            end = sexp_find(draw, "end")
+            ctx.move_to(to_float(start[1]), to_float(start[2]))
+            ctx.line_to(to_float(end[1]), to_float(end[2]))
         elif draw[0] == "fp_circle":
-            center = [n for n in draw if n[0] == "center"][0]
-            end = [n for n in draw if n[0] == "end"][0]
-            dx = float(end[1]) - float(center[1])
-            dy = float(end[2]) - float(center[2])
+            center = sexp_find(draw, "center")
+            end = sexp_find(draw, "end")
+            dx = to_float(end[1]) - to_float(center[1])
+            dy = to_float(end[2]) - to_float(center[2])
             r = math.sqrt(dx**2 + dy**2)
             ctx.new_sub_path()
-            ctx.arc(float(center[1]), float(center[2]), r, 0, 2*math.pi)
+            ctx.arc(to_float(center[1]), to_float(center[2]), r, 0, 2*math.pi)
         elif draw[0] == "fp_arc":
-            start = [n for n in draw if n[0] == "start"][0]
-            end = [n for n in draw if n[0] == "end"][0]
-            angle = [n for n in draw if n[0] == "angle"][0]
-            dx = float(end[1]) - float(start[1])
-            dy = float(end[2]) - float(start[2])
+            start = sexp_find(draw, "start")
+            end = sexp_find(draw, "end")
+            angle = sexp_find(draw, "angle")
+            dx = to_float(end[1]) - to_float(start[1])
+            dy = to_float(end[2]) - to_float(start[2])
             r = math.sqrt(dx**2 + dy**2)
             a_start = math.atan2(dy, dx)
-            a_end = a_start + float(angle[1]) * (math.pi / 180.0)
+            a_end = a_start + to_float(angle[1]) * (math.pi / 180.0)
             ctx.new_sub_path()
-            ctx.arc(float(start[1]), float(start[2]), r, a_start, a_end)
+            ctx.arc(to_float(start[1]), to_float(start[2]), r, a_start, a_end)
         ctx.stroke()
 
 
@@ -142,37 +138,37 @@ def pad_all_layers_front(layers):
 
 def pad_drill(drill, centre, ctx):
     try:
-        drill_size = float(drill[0][1])
-    except ValueError:
+        drill_size = to_float(drill[1])
+    except (ValueError, TypeError):
         pass
     else:
         ctx.arc(centre[0], centre[1], drill_size/2.0, 0, 2*math.pi)
         ctx.set_source_rgba(*drill_colour)
         ctx.fill()
-    offset = [n for n in drill[0] if n[0] == "offset"]
+    offset = sexp_find(drill, "offset")
     if offset:
-        centre[0] += float(offset[0][1])
-        centre[1] += float(offset[0][2])
+        centre[0] += to_float(offset[1])
+        centre[1] += to_float(offset[2])
 
 
 def pad_margins(pad):
-    mask_margin = [n for n in pad if n[0] == "solder_mask_margin"]
-    paste_margin = [n for n in pad if n[0] == "solder_paste_margin"]
-    paste_ratio = [n for n in pad if n[0] == "solder_paste_ratio"]
-    mask_margin = float(mask_margin[0][1]) if mask_margin else 0
-    paste_margin = float(paste_margin[0][1]) if paste_margin else 0
-    paste_ratio = float(paste_ratio[0][1]) if paste_ratio else 0
+    mask_margin = sexp_find(pad, "solder_mask_margin")
+    paste_margin = sexp_find(pad, "solder_paste_margin")
+    paste_ratio = sexp_find(pad, "solder_paste_ratio")
+    mask_margin = to_float(mask_margin[1]) if mask_margin else 0
+    paste_margin = to_float(paste_margin[1]) if paste_margin else 0
+    paste_ratio = to_float(paste_ratio[1]) if paste_ratio else 0
     return mask_margin, paste_margin, paste_ratio
 
 
 def draw_pad(ctxs, pad):
     shape = pad[3]
-    layers = [n for n in pad if n[0] == "layers"][0][1:]
+    layers = sexp_find(pad, "layers")[1:]
     pad_all_layers_front(layers)
-    centre = [float(v) for v in [n for n in pad if n[0] == "at"][0][1:]]
-    size = [float(v) for v in [n for n in pad if n[0] == "size"][0][1:]]
+    centre = [to_float(v) for v in sexp_find(pad, "at")[1:]]
+    size = [to_float(v) for v in sexp_find(pad, "size")[1:]]
 
-    drill = [n for n in pad if n[0] == "drill"]
+    drill = sexp_find(pad, "drill")
     if drill:
         pad_drill(drill, centre, ctxs['Drill'])
     mask_margin, paste_margin, paste_ratio = pad_margins(pad)
@@ -228,11 +224,11 @@ def draw(mod):
         lctx.translate(right, bottom)
         ctxs[layer] = lctx
 
-    for pad in (n for n in mod if n[0] == "pad"):
+    for pad in sexp_find_all(mod, "pad"):
         draw_pad(ctxs, pad)
 
     draw_types = ("fp_line", "fp_circle", "fp_arc")
-    for draw in (n for n in mod if n[0] in draw_types):
+    for draw in sexp_find_all(mod, *draw_types):
         draw_line(ctxs, draw)
 
     for layer in layer_stack:
@@ -244,8 +240,7 @@ def draw(mod):
 
 
 def main(modpath, outpath):
-    with open(modpath) as f:
-        sexp = sexp_parse(f.read())
+    sexp = sexp_load(modpath, nodes=True)
     img = draw(sexp)
     img.write_to_png(outpath)
 
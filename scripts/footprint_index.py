@@ -0,0 +1,89 @@
+"""
+footprint_index.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+An index of the footprints in one or more footprint libraries, for checking
+that the footprints symbols reference exist without a stat per symbol.
+"""
+
+from __future__ import print_function, division
+
+import os
+import re
+
+from sexp import load as sexp_load, find as sexp_find, select
+
+# Environment variable references in fp-lib-table URIs, such as ${KIPRJMOD}
+re_envvar = re.compile(r"\$\{([^}]*)\}")
+
+
+class FootprintIndex:
+    """
+    Maps library nicknames to .pretty directories, and lists the footprints
+    in each directory with a single scan the first time it is needed.
+    """
+    def __init__(self):
+        self.libs = {}
+        self._names = {}
+
+    def add_pretty(self, path, nickname=None):
+        """
+        Add the .pretty directory at `path`, by default with its name
+        without the .pretty extension as its nickname.
+        """
+        if nickname is None:
+            nickname = os.path.splitext(os.path.basename(
+                os.path.normpath(path)))[0]
+        self.libs[nickname] = path
+
+    def add_table(self, path):
+        """
+        Add every KiCad format library in the fp-lib-table file at `path`.
+        ${KIPRJMOD} in a library's URI is the directory containing the
+        table, and other variables are taken from the environment. Libraries
+        whose URI uses an undefined variable are left out.
+        """
+        env = dict(os.environ)
+        env["KIPRJMOD"] = os.path.dirname(os.path.abspath(path))
+        table = sexp_load(path)
+        for lib in select(table, "lib"):
+            if sexp_find(lib, "type")[1].lower() != "kicad":
+                continue
+            uri = sexp_find(lib, "uri")[1]
+            names = re_envvar.findall(uri)
+            if any(name not in env for name in names):
+                continue
+            uri = re_envvar.sub(lambda m: env[m.group(1)], uri)
+            self.add_pretty(uri, sexp_find(lib, "name")[1])
+
+    def names(self, nickname):
+        """
+        Return the set of names of the footprints in library `nickname`, or
+        None if there is no such library.
+        """
+        if nickname not in self._names:
+            path = self.libs.get(nickname)
+            if path is None:
+                return None
+            names = set()
+            try:
+                for entry in os.scandir(path):
+                    name, ext = os.path.splitext(entry.name)
+                    if ext == ".kicad_mod":
+                        names.add(name)
+            except OSError:
+                pass
+            self._names[nickname] = frozenset(names)
+        return self._names[nickname]
+
+    def exists(self, footprint):
+        """
+        Return whether `footprint`, as "nickname:name", exists, or None if
+        its library is not in the index.
+        """
+        nickname, _, name = footprint.partition(":")
+        names = self.names(nickname)
+        if names is None:
+            return None
+        return name in names
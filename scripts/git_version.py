@@ -0,0 +1,119 @@
+"""
+git_version.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Describe the version of the git repository containing a path, as
+`git describe --abbrev=8 --dirty=-dirty --always` does. The commit HEAD points
+to is read directly from `.git/HEAD`, the loose refs and `packed-refs`, and git
+is only run once for each commit in a process, to name it from the tags and
+check whether the tree is dirty.
+"""
+
+from __future__ import print_function, division
+
+import os
+import subprocess
+
+# Versions described so far, by path and HEAD commit, see `git_version`
+_versions = {}
+
+
+def gitdir(path):
+    """
+    Return the git directory and common directory of the repository
+    containing `path`, or None if it is not in one.
+    """
+    path = os.path.abspath(path)
+    if not os.path.isdir(path):
+        path = os.path.dirname(path)
+    while True:
+        dotgit = os.path.join(path, ".git")
+        if os.path.isfile(dotgit):
+            with open(dotgit) as f:
+                line = f.read().strip()
+            if not line.startswith("gitdir: "):
+                return None
+            dotgit = os.path.join(path, line[len("gitdir: "):])
+        if os.path.isdir(dotgit):
+            common = os.path.join(dotgit, "commondir")
+            if not os.path.isfile(common):
+                return dotgit, dotgit
+            with open(common) as f:
+                return dotgit, os.path.normpath(
+                    os.path.join(dotgit, f.read().strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def packed_refs(common):
+    """Return a dict of the object ID of each ref in packed-refs, by name."""
+    refs = {}
+    try:
+        with open(os.path.join(common, "packed-refs")) as f:
+            for line in f:
+                if line[0] not in "#^":
+                    sha, name = line.split()
+                    refs[name] = sha
+    except (IOError, OSError):
+        pass
+    return refs
+
+
+def resolve(path, name="HEAD"):
+    """
+    Return the object ID the ref `name` points to in the repository
+    containing `path`, following symbolic refs, or None if it points to
+    nothing.
+    """
+    dirs = gitdir(path)
+    if dirs is None:
+        return None
+    for depth in range(5):
+        for base in dirs:
+            refpath = os.path.join(base, *name.split("/"))
+            if os.path.isfile(refpath):
+                with open(refpath) as f:
+                    value = f.read().strip()
+                break
+        else:
+            return packed_refs(dirs[1]).get(name)
+        if not value.startswith("ref: "):
+            return value
+        name = value[len("ref: "):]
+    return None
+
+
+def git_describe(path):
+    """Run git describe in `path`, returning its output."""
+    # Handle running inside a git hook where the presence of these environment
+    # variables will cause problems
+    env = os.environ.copy()
+    if 'GIT_DIR' in env:
+        del env['GIT_DIR']
+    if 'GIT_INDEX_FILE' in env:
+        del env['GIT_INDEX_FILE']
+
+    args = ["git", "describe", "--abbrev=8", "--dirty=-dirty", "--always"]
+    git = subprocess.Popen(args, cwd=path, env=env, stdout=subprocess.PIPE)
+    return git.stdout.read().decode().strip()
+
+
+def git_version(path):
+    """
+    Return the version of the git repository containing `path`. The result is
+    kept for the rest of the process, until HEAD moves to another commit;
+    call `clear` if the tree may have become dirty or clean since.
+    """
+    path = os.path.abspath(path)
+    key = (path, resolve(path))
+    if key not in _versions:
+        _versions[key] = git_describe(path)
+    return _versions[key]
+
+
+def clear():
+    """Forget the versions found so far."""
+    _versions.clear()
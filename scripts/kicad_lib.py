@@ -0,0 +1,281 @@
+"""
+kicad_lib.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Parse and emit legacy EESchema .lib symbol library files.
+
+A Library holds the file's header and footer lines and a list of items, each
+either a Symbol or a line of text (comments and blank lines) between symbols.
+Each Symbol's body is likewise a list of Field, Pin and Graphic objects and
+any lines not otherwise understood, such as DRAW and ENDDRAW. Lines which
+cannot be represented exactly are kept as text, so that emitting a parsed
+library always reproduces the original byte-for-byte.
+"""
+
+from __future__ import print_function, division
+
+import os
+import re
+
+# Integers as written by KiCAD, so that they are emitted unchanged
+_int = r"(0|-?[1-9][0-9]*)"
+
+# Anything after the parameters, such as trailing whitespace or further
+# tokens, is kept as it is so the line can be emitted unchanged
+re_field = re.compile(r'F(0|[1-9][0-9]*) "([^"]*)" {0} {0} {0} ([HV]) ([VI])'
+                      r' ([LRC]) ([TBC][NI]?[NB]?)(.*)$'.format(_int))
+re_pin = re.compile(r"X (\S+) (\S+) {0} {0} {0} ([UDLR]) {0} {0} {0} {0}"
+                    r" (\S+)(?: (\S+))?(.*)$".format(_int))
+
+GRAPHIC_KINDS = ("A", "B", "C", "P", "S", "T")
+
+
+class Field:
+    """A symbol field line such as F0 (reference) or F1 (name)."""
+    __slots__ = ("number", "value", "x", "y", "size", "orient", "visible",
+                 "hjust", "vjust", "extra")
+
+    def __init__(self, number, value, x, y, size, orient, visible, hjust,
+                 vjust, extra=""):
+        self.number = number
+        self.value = value
+        self.x = x
+        self.y = y
+        self.size = size
+        self.orient = orient
+        self.visible = visible
+        self.hjust = hjust
+        self.vjust = vjust
+        self.extra = extra
+
+    @classmethod
+    def parse(cls, line):
+        """Return the Field for `line`, or None if it cannot be parsed."""
+        match = re_field.match(line)
+        if match is None:
+            return None
+        number, value, x, y, size, orient, visible, hjust, vjust, extra = \
+            match.groups()
+        return cls(int(number), value, int(x), int(y), int(size), orient,
+                   visible, hjust, vjust, extra)
+
+    def emit(self):
+        return 'F{} "{}" {} {} {} {} {} {} {}{}'.format(
+            self.number, self.value, self.x, self.y, self.size, self.orient,
+            self.visible, self.hjust, self.vjust, self.extra)
+
+
+class Pin:
+    """A symbol pin line, starting with X."""
+    __slots__ = ("name", "num", "x", "y", "length", "orient", "num_size",
+                 "name_size", "unit", "convert", "etype", "shape", "extra")
+
+    def __init__(self, name, num, x, y, length, orient, num_size, name_size,
+                 unit, convert, etype, shape=None, extra=""):
+        self.name = name
+        self.num = num
+        self.x = x
+        self.y = y
+        self.length = length
+        self.orient = orient
+        self.num_size = num_size
+        self.name_size = name_size
+        self.unit = unit
+        self.convert = convert
+        self.etype = etype
+        self.shape = shape
+        self.extra = extra
+
+    @classmethod
+    def parse(cls, line):
+        """Return the Pin for `line`, or None if it cannot be parsed."""
+        match = re_pin.match(line)
+        if match is None:
+            return None
+        (name, num, x, y, length, orient, num_size, name_size, unit, convert,
+         etype, shape, extra) = match.groups()
+        return cls(name, num, int(x), int(y), int(length), orient,
+                   int(num_size), int(name_size), int(unit), int(convert),
+                   etype, shape, extra)
+
+    def emit(self):
+        line = "X {} {} {} {} {} {} {} {} {} {} {}".format(
+            self.name, self.num, self.x, self.y, self.length, self.orient,
+            self.num_size, self.name_size, self.unit, self.convert,
+            self.etype)
+        if self.shape is not None:
+            line += " " + self.shape
+        return line + self.extra
+
+
+class Graphic:
+    """
+    A drawing primitive: an arc (A), Bezier curve (B), circle (C), polyline
+    (P), rectangle (S) or text (T), with its parameters as strings.
+    """
+    __slots__ = ("kind", "params")
+
+    def __init__(self, kind, params):
+        self.kind = kind
+        self.params = params
+
+    @classmethod
+    def parse(cls, line):
+        params = line.split(" ")
+        return cls(params[0], params[1:])
+
+    @property
+    def fill(self):
+        """The fill of a shape, N for none, F foreground or f background."""
+        if self.kind != "T" and self.params:
+            return self.params[-1]
+
+    def emit(self):
+        return " ".join([self.kind] + self.params)
+
+
+class Symbol:
+    """
+    A symbol from DEF to ENDDEF. `params` are the DEF line's remaining
+    parameters as strings, and `body` lists the lines in between.
+    """
+    __slots__ = ("name", "reference", "params", "body", "closed")
+
+    def __init__(self, name, reference, params, body=None, closed=True):
+        self.name = name
+        self.reference = reference
+        self.params = params
+        self.body = [] if body is None else body
+        self.closed = closed
+
+    @property
+    def fields(self):
+        return [item for item in self.body if isinstance(item, Field)]
+
+    @property
+    def pins(self):
+        return [item for item in self.body if isinstance(item, Pin)]
+
+    @property
+    def graphics(self):
+        return [item for item in self.body if isinstance(item, Graphic)]
+
+    def field(self, number):
+        """Return the field with the given number, or None."""
+        for item in self.body:
+            if isinstance(item, Field) and item.number == number:
+                return item
+
+    def lines(self):
+        yield " ".join(["DEF", self.name, self.reference] + self.params)
+        for item in self.body:
+            yield item if isinstance(item, str) else item.emit()
+        if self.closed:
+            yield "ENDDEF"
+
+
+class Library:
+    """
+    A symbol library. `header` holds the EESchema-LIBRARY and encoding lines,
+    `footer` the final line, normally "# End Library", and `items` the
+    symbols and text lines in between. `newline` records whether the file
+    ended with a newline.
+    """
+    __slots__ = ("header", "items", "footer", "newline")
+
+    def __init__(self, header, items, footer, newline=True):
+        self.header = header
+        self.items = items
+        self.footer = footer
+        self.newline = newline
+
+    @property
+    def symbols(self):
+        return [item for item in self.items if isinstance(item, Symbol)]
+
+    @property
+    def comments(self):
+        """All comment lines, both between and within symbols."""
+        out = []
+        for item in self.items:
+            if isinstance(item, Symbol):
+                out += [line for line in item.body
+                        if isinstance(line, str) and line.startswith("#")]
+            elif item.startswith("#"):
+                out.append(item)
+        return out
+
+    def item_lines(self):
+        """Yield each line of the library between the header and footer."""
+        for item in self.items:
+            if isinstance(item, Symbol):
+                for line in item.lines():
+                    yield line
+            else:
+                yield item
+
+    def emit(self):
+        lines = self.header + list(self.item_lines()) + self.footer
+        return "\n".join(lines) + ("\n" if self.newline else "")
+
+
+def _parse_line(line):
+    """Parse a line from inside a symbol, returning it as text if unknown."""
+    kind = line.partition(" ")[0]
+    item = None
+    if kind in GRAPHIC_KINDS:
+        item = Graphic.parse(line)
+    elif kind == "X":
+        item = Pin.parse(line)
+    elif kind[:1] == "F" and kind[1:].isdigit():
+        item = Field.parse(line)
+    return line if item is None else item
+
+
+def parse(text):
+    """Parse the contents of a .lib file into a Library."""
+    lines = text.split("\n")
+    newline = len(lines) > 1 and lines[-1] == ""
+    if newline:
+        lines.pop()
+    header = lines[:2]
+    footer = lines[2:][-1:]
+    items = []
+    symbol = None
+    for line in lines[2:-1]:
+        if symbol is not None:
+            if line == "ENDDEF":
+                symbol = None
+            else:
+                symbol.body.append(_parse_line(line))
+        elif line.startswith("DEF ") and len(line.split(" ")) >= 3:
+            params = line.split(" ")
+            symbol = Symbol(params[1], params[2], params[3:], closed=False)
+            items.append(symbol)
+        else:
+            items.append(line)
+            continue
+        if symbol is None:
+            items[-1].closed = True
+    return Library(header, items, footer, newline)
+
+
+# Libraries parsed by `load`, by path, with the stat they were parsed at
+_loaded = {}
+
+
+def load(path):
+    """
+    Parse the .lib file at `path`. Parsed libraries are kept and returned
+    again while the file is unchanged, so they must not be modified.
+    """
+    st = os.stat(path)
+    stat = (st.st_mtime_ns, st.st_size)
+    cached = _loaded.get(path)
+    if cached is not None and cached[0] == stat:
+        return cached[1]
+    with open(path) as f:
+        lib = parse(f.read())
+    _loaded[path] = (stat, lib)
+    return lib
@@ -8,6 +8,13 @@ Helper functions for generating KiCAD footprint files.
 
 from __future__ import print_function, division
 
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from sexp import parse as sexp_parse, load as sexp_load
+from build_cache import BuildCache
+
 CTYD_GAP = 0.25
 CTYD_GRID = 0.05
 CTYD_WIDTH = 0.01
@@ -88,3 +95,94 @@ def draw_square(width, height, centre, layer, thickness):
     out.append(fp_line(se, sw, layer, thickness))
     out.append(fp_line(sw, nw, layer, thickness))
     return nw, ne, se, sw, out
+
+
+def _build_footprint(job):
+    """
+    Generate the footprint for one (generator, arg, prettypath) job, returning
+    its path and its contents, or None for the contents if the existing file
+    already matches (ignoring tedit).
+    """
+    generator, arg, prettypath = job
+    name, fp = generator(arg)
+    path = os.path.join(prettypath, name + ".kicad_mod")
+    if os.path.isfile(path):
+        old = [n for n in sexp_load(path) if n[0] != "tedit"]
+        new = [n for n in sexp_parse(fp) if n[0] != "tedit"]
+        if new == old:
+            return path, None
+    return path, fp
+
+
+def build_footprints(prettypath, jobs, verify=False, incremental=False):
+    """
+    Generate each footprint in `jobs`, a list of (generator, arg) pairs where
+    generator(arg) returns (name, contents), and write out any which differ
+    from the existing file in `prettypath`.
+
+    Footprints recorded in the build cache as up to date are skipped. The rest
+    are generated and compared across a process pool sized to the CPU count,
+    but results are handled in the order of `jobs`, so output and written
+    files are the same as building one at a time.
+
+    With `verify`, nothing is written and the result is whether every
+    footprint was already up to date. With `incremental`, cached footprints
+    whose files have their recorded modification time and size are not read.
+    """
+    module = jobs[0][0].__module__
+    section = os.path.splitext(os.path.basename(sys.modules[module].__file__))
+    cache = BuildCache(prettypath, section[0], (module, __name__, "sexp"))
+    prettykey = os.path.abspath(prettypath)
+    keys = [cache.key(prettykey, generator.__name__, arg)
+            for generator, arg in jobs]
+    cached = [cache.paths(key, incremental) for key in keys]
+    stale = [(generator, arg, prettypath)
+             for (generator, arg), paths in zip(jobs, cached) if paths is None]
+
+    pool = None
+    workers = min(os.cpu_count() or 1, len(stale))
+    if workers <= 1:
+        results = map(_build_footprint, stale)
+    else:
+        chunksize = max(1, len(stale) // (workers * 4))
+        pool = ProcessPoolExecutor(workers)
+        results = pool.map(_build_footprint, stale, chunksize=chunksize)
+    try:
+        ok = _handle_footprints(prettypath, keys, cached, results, cache,
+                                verify)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    cache.save(prune=ok is not False)
+    return ok
+
+
+def _handle_footprints(prettypath, keys, cached, results, cache, verify):
+    results = iter(results)
+    for key, paths in zip(keys, cached):
+        if paths is not None:
+            path = os.path.join(prettypath, os.path.basename(paths[0]))
+            fp = None
+        else:
+            path, fp = next(results)
+
+        if verify:
+            print("Verifying", path)
+
+        # Existing file is identical
+        if fp is None:
+            if paths is None:
+                cache.update(key, path)
+            continue
+
+        # If not, either verification failed or we should output the new fp
+        if verify:
+            return False
+        else:
+            with open(path, "w") as f:
+                f.write(fp)
+            cache.update(key, path)
+
+    # If we finished and didn't return yet, verification has succeeded.
+    if verify:
+        return True
@@ -8,81 +8,508 @@ from __future__ import print_function, division
 
 
 import sys
-import copy
 import datetime
+import operator
+import collections
 from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
 
-from sexp import parse as sexp_parse, generate as sexp_generate
+from sexp import iterload as sexp_iterload, Writer as SexpWriter, \
+    template as sexp_template, generate as sexp_generate, to_decimal
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def simples(n, out, xr, xp, yr, yp):
-    for x in range(xr):
-        for y in range(yr):
-            xx = x * xp
-            yy = y * yp
-            simple(n, out, xx, yy)
+# Stands in for each coordinate and angle in the text generated for a
+# board's items
+HOLE = object()
 
+# Kinds of hole: a list's x and y coordinates, or the angle after them
+POINT = "point"
+ANGLE = "angle"
 
-def simple(n, out, x, y):
-    new = copy.deepcopy(n)
-    for idx, child in enumerate(new):
-        if child[0] in ("at", "start", "end"):
-            new[idx][1] = Decimal(child[1]) + x
-            new[idx][2] = Decimal(child[2]) + y
-    out.append(new)
+# Number of coordinates filled in for each chunk of text written
+CHUNK_SIZE = 4096
+
+# For each rotation of a copy, anticlockwise in degrees as KiCAD measures
+# angles, the axis and sign of the board's coordinate which gives each of the
+# copy's x and y coordinates, once offset. The y axis points down.
+ROTATIONS = {0: ((0, 1), (1, 1)), 90: ((1, 1), (0, -1)),
+             180: ((0, -1), (1, -1)), 270: ((1, -1), (0, 1))}
+
+
+class Board:
+    """
+    The items of a board to be repeated across a panel, kept as the text
+    generated for them once with a hole in place of each coordinate, and the
+    coordinates themselves. Each copy is written by filling in the holes with
+    transformed coordinates, so no copy of the items is ever made.
+
+    Copies may be rotated about `centre`, by default the middle of the box
+    around all the coordinates, if the items were added with holes for
+    their angles too.
+    """
+    def __init__(self):
+        self.texts = [""]
+        self.xs = []
+        self.ys = []
+        self.angles = []
+        self.centre = None
+        self.empty = True
+        self.points = None
+        self._unique = {}
+        self._rotated = {}
+
+    def add(self, item):
+        """Add an item as the texts, coordinates and angles of `template`."""
+        texts, xs, ys, angles = item
+        base = len(self.texts) - 1
+        self.xs += xs
+        self.ys += ys
+        self.angles += [(base + hole, angle) for hole, angle in angles]
+        self.points = None
+        self._rotated = {}
+        if not self.empty:
+            self.texts[-1] += " "
+        self.empty = False
+        self.texts[-1] += texts[0]
+        # Most of the text between holes recurs many times, so keep just one
+        # copy of each distinct piece
+        unique = self._unique
+        self.texts += [unique.setdefault(text, text) for text in texts[1:]]
+
+    def prepare(self, rotations=()):
+        """
+        Gather the coordinates into `Points` if NumPy is available, and fill
+        in the angles for each of `rotations`, ahead of writing copies.
+        """
+        if self.points is None and numpy is not None:
+            self.points = Points.create(self.xs, self.ys) or False
+        for rotation in rotations:
+            self.rotated(rotation)
+
+    def rotated(self, rotation):
+        """
+        Return the texts with the angles of a copy rotated by `rotation`
+        filled in, leaving holes for the coordinates only.
+        """
+        if not self.angles:
+            return self.texts
+        if rotation not in self._rotated:
+            texts = self.texts
+            out = []
+            end = 0
+            for hole, angle in self.angles:
+                if hole >= end:
+                    out += texts[end:hole + 1]
+                out[-1] += _angle(angle, rotation) + texts[hole + 1]
+                end = hole + 2
+            out += texts[end:]
+            self._rotated[rotation] = out
+        return self._rotated[rotation]
+
+    def transform(self, x, y, rotation):
+        """
+        Return the transform of a copy rotated by `rotation` about `centre`
+        and offset by `x`, `y`: for each of the copy's x and y coordinates,
+        the axis and sign of the board's coordinate and the offset to add.
+        """
+        if rotation == 0:
+            return (0, 1, x), (1, 1, y)
+        if self.centre is None:
+            self.centre = middle(self.xs, self.ys)
+        centre = self.centre
+        (xaxis, xsign), (yaxis, ysign) = ROTATIONS[rotation]
+        return ((xaxis, xsign, centre[0] - xsign * centre[xaxis] + x),
+                (yaxis, ysign, centre[1] - ysign * centre[yaxis] + y))
+
+    def chunks(self, x, y, rotation=0):
+        """
+        Yield the text of a copy of every item, rotated by `rotation` and
+        offset by `x`, `y`, in chunks. When NumPy is available, the
+        coordinates are transformed and formatted as whole arrays, see
+        `Points`, otherwise one at a time.
+        """
+        self.prepare()
+        texts = self.rotated(rotation)
+        transform = self.transform(x, y, rotation)
+        text = None
+        if self.points:
+            text = self.points.format(rotation, texts, transform)
+        if text is not None:
+            yield text
+            return
+        (xaxis, xsign, xoffset), (yaxis, ysign, yoffset) = transform
+        us = (self.xs, self.ys)[xaxis]
+        vs = (self.xs, self.ys)[yaxis]
+        xop = operator.add if xsign > 0 else operator.sub
+        yop = operator.add if ysign > 0 else operator.sub
+        yield texts[0]
+        for start in range(0, len(us), CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, len(us))
+            chunk = []
+            for idx in range(start, end):
+                chunk += (str(xop(xoffset, us[idx])), texts[2*idx + 1],
+                          str(yop(yoffset, vs[idx])), texts[2*idx + 2])
+            yield "".join(chunk)
+
+    def write(self, out, x, y, rotation=0):
+        """Append a copy of every item to `out`, as from `chunks`."""
+        if not self.empty:
+            out.append_text(self.chunks(x, y, rotation))
+
+    def text(self, x, y, rotation=0):
+        """Return the text `write` would append for a copy."""
+        return "".join(self.chunks(x, y, rotation))
+
+
+def middle(xs, ys):
+    """Return the middle of the box around the coordinates `xs`, `ys`."""
+    return (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+
+
+def _angle(angle, rotation):
+    """
+    Return the text for an `angle`, or None for no angle, rotated by
+    `rotation`, with the space before it.
+    """
+    if angle is None:
+        return " {}".format(rotation) if rotation else ""
+    angle += rotation
+    if angle >= 360:
+        angle -= 360
+    return " {}".format(angle)
+
+
+def _fixed(value):
+    """
+    Return the Decimal `value` as integer nanometres, the number of decimal
+    places it is written with and whether it is negative zero, or None if it
+    is not written as plain digits with at most six decimal places.
+    """
+    whole, _, frac = str(value).partition(".")
+    if len(frac) > 6:
+        return None
+    try:
+        nm = int(whole + frac.ljust(6, "0"))
+    except ValueError:
+        return None
+    if abs(nm) >= 1 << 62:
+        return None
+    return nm, len(frac), nm == 0 and whole.startswith("-")
+
+
+class Points:
+    """
+    A board's coordinates held in NumPy arrays as integer nanometres, with
+    the number of decimal places each is written with. A copy is transformed
+    and formatted with a few operations on the whole arrays per copy,
+    producing exactly the text which `Board` would by adding and formatting
+    each coordinate as a Decimal.
+    """
+    def __init__(self, nm, places, negzero):
+        self.nm = numpy.array(nm, numpy.int64).reshape(-1, 2)
+        self.places = numpy.array(places, numpy.int64).reshape(-1, 2)
+        self.negzero = numpy.array(negzero, bool).reshape(-1, 2)
+        self.templates = {}
+
+    @classmethod
+    def create(cls, xs, ys):
+        """
+        Return the Points for a board's coordinates, or None if any of them
+        cannot be formatted exactly from its Points.
+        """
+        nm = []
+        places = []
+        negzero = []
+        for x, y in zip(xs, ys):
+            for value in (x, y):
+                fixed = _fixed(value)
+                if fixed is None:
+                    return None
+                nm.append(fixed[0])
+                places.append(fixed[1])
+                negzero.append(fixed[2])
+        return cls(nm, places, negzero)
 
+    def format(self, key, texts, transform):
+        """
+        Return the text of a copy of the board with `texts` between its
+        coordinates, which are transformed by `transform` as from
+        `Board.transform`, or None if the transform's offsets cannot be
+        represented exactly. The `texts` are encoded once for each `key`.
+        """
+        if key not in self.templates:
+            encoded = [text.encode("utf-8") for text in texts]
+            self.templates[key] = (
+                numpy.frombuffer(b"".join(encoded), numpy.uint8),
+                numpy.array([len(text) for text in encoded], numpy.int64))
+        text, text_lengths = self.templates[key]
 
-def zones(n, out, xr, xp, yr, yp):
-    for x in range(xr):
-        for y in range(yr):
-            xx = x * xp
-            yy = y * yp
-            zone(n, out, xx, yy)
+        columns = []
+        for axis, sign, offset in transform:
+            fixed = _fixed(offset)
+            if fixed is None:
+                return None
+            onm, oplaces, onegzero = fixed
+            # A sum is only negative zero if both operands were, and a
+            # difference only if the offset was and the coordinate was not
+            negzero = self.negzero[:, axis]
+            columns.append((
+                onm + sign * self.nm[:, axis],
+                numpy.maximum(self.places[:, axis], oplaces),
+                onegzero & (negzero if sign > 0 else ~negzero)))
+        nm = numpy.column_stack([column[0] for column in columns]).ravel()
+        places = numpy.column_stack(
+            [column[1] for column in columns]).ravel()
+        negzero = numpy.column_stack(
+            [column[2] for column in columns]).ravel()
 
+        # Decimal sums are exact, with the most decimal places of either
+        # operand. Each coordinate is laid out in a row as a sign, the whole
+        # millimetres left-aligned, a point and six decimal places, and then
+        # only the characters each coordinate needs are kept.
+        count = len(nm)
+        whole, frac = numpy.divmod(numpy.abs(nm), 1000000)
+        width = len(str(whole.max()))
+        chars = numpy.empty((count, width + 8), numpy.uint8)
+        keep = numpy.empty(chars.shape, bool)
+        chars[:, 0] = ord("-")
+        keep[:, 0] = neg = (nm < 0) | ((nm == 0) & negzero)
+        lengths = places + 1 + neg + (places > 0)
+        whole, chars[:, width] = numpy.divmod(whole, 10)
+        keep[:, width] = True
+        for col in range(width - 1, 0, -1):
+            keep[:, col] = whole > 0
+            lengths += keep[:, col]
+            whole, chars[:, col] = numpy.divmod(whole, 10)
+        chars[:, width+1] = ord(".")
+        keep[:, width+1] = places > 0
+        for col in range(width + 7, width + 1, -1):
+            frac, chars[:, col] = numpy.divmod(frac, 10)
+        chars[:, 1:width+1] += ord("0")
+        chars[:, width+2:] += ord("0")
+        keep[:, width+2:] = numpy.arange(6) < places[:, None]
+        values = chars[keep]
 
-def zone(n, out, x, y):
-    new = copy.deepcopy(n)
-    for idx, child in enumerate(new):
+        # Interleave the text with the coordinates
+        segments = numpy.zeros(2 * len(text_lengths) - 1, numpy.int64)
+        segments[0::2] = text_lengths
+        segments[1::2] = lengths
+        is_value = numpy.repeat(
+            numpy.arange(len(segments)) % 2 == 1, segments)
+        out = numpy.empty(len(is_value), numpy.uint8)
+        out[~is_value] = text
+        out[is_value] = values
+        return out.tobytes().decode("utf-8")
+
+
+def template(node, holes, angles=False):
+    """
+    Return the text of the item `node` split at each of its coordinates, as
+    from `sexp.template`, the lists of its x and y coordinates, and a list
+    of (hole, angle) pairs. Calling `holes` with `node` yields the lists
+    holding its coordinates and angles, in order, with their kind.
+
+    Angles are only split out with `angles`, so copies can be rotated. Each
+    angle's hole includes the space before it, as an angle may be missing,
+    in which case its angle is None. `node` is left unchanged.
+    """
+    xs = []
+    ys = []
+    found = []
+    kinds = []
+    for lst, kind in holes(node):
+        if kind == POINT:
+            xs.append(to_decimal(lst[1]))
+            ys.append(to_decimal(lst[2]))
+            found.append((lst, lst[1:3]))
+            lst[1] = lst[2] = HOLE
+            kinds += (POINT, POINT)
+        elif angles:
+            angle = lst[3] if len(lst) > 3 else None
+            try:
+                angle = to_decimal(angle)
+                found.append((lst, [angle]))
+                lst[3] = HOLE
+            except (TypeError, ArithmeticError):
+                angle = None
+                lst.insert(3, HOLE)
+                found.append((lst, None))
+            kinds.append(angle)
+    texts = sexp_template(node, HOLE, depth=1)
+    for lst, atoms in reversed(found):
+        if atoms is None:
+            del lst[3]
+        elif len(atoms) == 1:
+            lst[3] = atoms[0]
+        else:
+            lst[1:3] = atoms
+    turns = []
+    for hole, kind in enumerate(kinds):
+        if kind is not POINT:
+            texts[hole] = texts[hole][:-1]
+            turns.append((hole, kind))
+    return texts, xs, ys, turns
+
+
+def simple(n):
+    for child in n:
+        if child[0] in ("at", "start", "end"):
+            yield child, POINT
+            if child[0] == "at" and n[0] in ("module", "gr_text"):
+                yield child, ANGLE
+        elif n[0] == "module" and child[0] in ("pad", "fp_text"):
+            for at in child:
+                if at[0] == "at":
+                    yield at, ANGLE
+
+
+def zone(n):
+    for child in n:
         if child[0] in ("polygon", "filled_polygon"):
-            new[idx][1] = ["pts"]
-            for (xy, xx, yy) in n[idx][1][1:]:
-                new[idx][1].append([xy, Decimal(xx)+x, Decimal(yy)+y])
-    out.append(new)
+            for xy in child[1][1:]:
+                yield xy, POINT
+
+
+# The board each worker process makes copies of, see `copies`
+_board = None
+
+
+def _set_board(board):
+    global _board
+    _board = board
+
+
+def _copy(position):
+    return _board.text(*position)
+
+
+def copies(board, positions, jobs):
+    """
+    Yield the text of a copy of `board` at each (x, y, rotation) in
+    `positions`, in order, made in `jobs` worker processes. At most two
+    copies per worker are waiting at once, so memory use does not grow with
+    the number of positions.
+    """
+    board.prepare(set(rotation for x, y, rotation in positions))
+    pending = collections.deque()
+    with ProcessPoolExecutor(jobs, initializer=_set_board,
+                             initargs=(board,)) as pool:
+        for position in positions:
+            pending.append(pool.submit(_copy, position))
+            if len(pending) > 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(inpath, outpath, xr, xp, yr, yp, jobs=1, fills="keep", rotate=0,
+         alternate=0):
+    """
+    Write a panel of `xr` by `yr` copies of the board at `inpath`, spaced
+    by `xp` and `yp`, to `outpath`. With `jobs` greater than one, the copies
+    are made in that many worker processes and written in the same order,
+    giving an identical file.
+
+    `fills` chooses which copies include the filled areas of zones, which
+    KiCAD recalculates when the zones are refilled: "keep" for all of them,
+    "first" for only the first copy, or "drop" for none.
+
+    Every copy is rotated about the middle of the board by `rotate`, and
+    those copies whose column and row numbers add up to an odd number by
+    `alternate` as well, in degrees anticlockwise. Copies alternately
+    rotated by 180 degrees can be fitted together more tightly, or balance
+    copper across the panel.
+    """
+    positions = [(x * xp, y * yp, (rotate + alternate * ((x + y) % 2)) % 360)
+                 for x in range(xr) for y in range(yr)]
+    angles = any(rotation for x, y, rotation in positions)
+    board = Board()
+    # The board for the first copy, which only differs when it keeps fills
+    first = Board() if fills == "first" else board
+    fill_size = 0
+    with open(outpath, "w") as outf:
+        out = SexpWriter(outf, "kicad_pcb")
+        out.append(["version", 4])
+        out.append(["host", "panelise.py",
+                    datetime.datetime.utcnow().isoformat()])
 
+        simple_types = ("gr_arc", "gr_line", "gr_text", "segment", "via",
+                        "module")
 
-def main(inpath, outpath, xr, xp, yr, yp):
-    with open(inpath) as f:
-        insexp = sexp_parse(f.read())
+        for node in sexp_iterload(inpath):
+            if node[0] in ("page", "layers", "setup", "net", "net_class"):
+                out.append(node)
+            elif node[0] in simple_types:
+                item = template(node, simple, angles)
+                board.add(item)
+                if first is not board:
+                    first.add(item)
+            elif node[0] == "zone" and fills != "keep":
+                unfilled = [child for child in node
+                            if child[0] != "filled_polygon"]
+                fill_size += sum(len(sexp_generate(child, depth=2)) + 1
+                                 for child in node
+                                 if child[0] == "filled_polygon")
+                board.add(template(unfilled, zone, angles))
+                if first is not board:
+                    first.add(template(node, zone, angles))
+            elif node[0] == "zone":
+                board.add(template(node, zone, angles))
 
-    outsexp = [
-        "kicad_pcb",
-        ["version", 4],
-        ["host", "panelise.py", datetime.datetime.utcnow().isoformat()],
-    ]
+        if first is not board and positions:
+            # Rotate every copy about the same point, though only the first
+            # has the filled areas of zones
+            if angles and not first.empty:
+                board.centre = middle(first.xs, first.ys)
+            first.write(out, *positions.pop(0))
+        if jobs > 1 and not board.empty:
+            for text in copies(board, positions, jobs):
+                out.append_text([text])
+        else:
+            for x, y, rotation in positions:
+                board.write(out, x, y, rotation)
 
-    simple_types = ("gr_arc", "gr_line", "gr_text", "segment", "via", "module")
+        out.close()
 
-    for node in insexp:
-        if node[0] in ("page", "layers", "setup", "net", "net_class"):
-            outsexp.append(node)
-        elif node[0] in simple_types:
-            simples(node, outsexp, xr, xp, yr, yp)
-        elif node[0] == "zone":
-            zones(node, outsexp, xr, xp, yr, yp)
+    if fills != "keep":
+        print("Left out zone fills from {} copies, saving about {} bytes"
+              .format(len(positions), fill_size * len(positions)))
 
-    with open(outpath, "w") as f:
-        f.write(sexp_generate(outsexp))
 
+def usage():
+    print("Usage: {} <in.kicad_pcb> <x repeat> <x pitch> <y repeat>"
+          " <y pitch> <out.kicad_pcb> [--jobs N] [--fills keep|first|drop]"
+          " [--rotate 0|90|180|270] [--alternate 0|90|180|270]"
+          .format(sys.argv[0]))
+    sys.exit(1)
 
 if __name__ == "__main__":
-    if len(sys.argv) == 7:
-        inpath = sys.argv[1]
-        x_repeat = int(sys.argv[2])
-        x_pitch = Decimal(sys.argv[3])
-        y_repeat = int(sys.argv[4])
-        y_pitch = Decimal(sys.argv[5])
-        outpath = sys.argv[6]
-        main(inpath, outpath, x_repeat, x_pitch, y_repeat, y_pitch)
-    else:
-        print("Usage: {} <in.kicad_pcb> <x repeat> <x pitch> <y repeat>"
-              " <y pitch> <out.kicad_pcb>".format(sys.argv[0]))
+    if len(sys.argv) < 7 or len(sys.argv) % 2 == 0:
+        usage()
+    inpath = sys.argv[1]
+    x_repeat = int(sys.argv[2])
+    x_pitch = Decimal(sys.argv[3])
+    y_repeat = int(sys.argv[4])
+    y_pitch = Decimal(sys.argv[5])
+    outpath = sys.argv[6]
+    jobs = 1
+    fills = "keep"
+    rotate = 0
+    alternate = 0
+    for flag, value in zip(sys.argv[7::2], sys.argv[8::2]):
+        if flag == "--jobs" and value.isdigit() and int(value) > 0:
+            jobs = int(value)
+        elif flag == "--fills" and value in ("keep", "first", "drop"):
+            fills = value
+        elif flag == "--rotate" and value in ("0", "90", "180", "270"):
+            rotate = int(value)
+        elif flag == "--alternate" and value in ("0", "90", "180", "270"):
+            alternate = int(value)
+        else:
+            usage()
+    main(inpath, outpath, x_repeat, x_pitch, y_repeat, y_pitch, jobs, fills,
+         rotate, alternate)
@@ -8,59 +8,485 @@ S-Expression parser/emitter
 
 from __future__ import print_function, division
 
+import os
+import gc
 import re
+import mmap
+import itertools
+from sys import intern
 from decimal import Decimal
 
 
-def parse(sexp):
+# A token is a single paren or an atom. Atoms are runs of bare characters and
+# "quoted" segments separated only by spaces and newlines. As in the original
+# per-character parser, an open paren directly after an atom starts a new list
+# without ending the atom, so such parens are matched as part of the atom.
+_token = re.compile(r'[^() \n"][^) \n"]*(?:"[^"]*"?[^) \n"]*)*|[()]'
+                    r'|"[^"]*"?[^) \n"]*(?:"[^"]*"?[^) \n"]*)*')
+
+# The same for undecoded file contents, where a carriage return is also a
+# separator as it would have been translated to a newline when read as text.
+_btoken = re.compile(br'[^() \r\n"][^) \r\n"]*(?:"[^"]*"?[^) \r\n"]*)*|[()]'
+                     br'|"[^"]*"?[^) \r\n"]*(?:"[^"]*"?[^) \r\n"]*)*')
+
+
+# Nodes with fewer children than this are scanned rather than indexed, as
+# building the index would cost more than the scan it saves.
+_INDEX_MIN_SIZE = 16
+
+
+class Node(list):
     """
-    Parse an S-expression into Python lists.
+    A list which keeps an index of its child lists by name, so that `find`
+    and `find_all` do not need to scan every child. The index is built the
+    first time it is needed, interning the names as it goes, and is dropped
+    whenever the list itself is changed. Renaming a child in place (by
+    assigning to its first element) is not noticed.
     """
-    r = [[]]
-    token = None
+    __slots__ = ("_index",)
+
+    def _names(self):
+        """Return a dict mapping each child name to its positions."""
+        try:
+            index = self._index
+        except AttributeError:
+            index = None
+        if index is None:
+            index = {}
+            for idx, child in enumerate(self):
+                if isinstance(child, list) and child:
+                    name = child[0]
+                    if isinstance(name, str):
+                        name = intern(name)
+                        list.__setitem__(child, 0, name)
+                    try:
+                        index[name].append(idx)
+                    except KeyError:
+                        index[name] = [idx]
+                    except TypeError:
+                        pass
+            self._index = index
+        return index
+
+    def find(self, *names):
+        """Return the first child whose name is in `names`, or None."""
+        if len(self) < _INDEX_MIN_SIZE:
+            for child in self:
+                if isinstance(child, list) and child and child[0] in names:
+                    return child
+            return None
+        index = self._names()
+        if len(names) == 1:
+            positions = index.get(names[0])
+            return self[positions[0]] if positions else None
+        positions = [index[name][0] for name in names if name in index]
+        return self[min(positions)] if positions else None
+
+    def find_all(self, *names):
+        """Return all children whose name is in `names`, in order."""
+        if len(self) < _INDEX_MIN_SIZE:
+            return [child for child in self
+                    if isinstance(child, list) and child and child[0] in names]
+        index = self._names()
+        if len(names) == 1:
+            return [self[idx] for idx in index.get(names[0], ())]
+        positions = [idx for name in names for idx in index.get(name, ())]
+        return [self[idx] for idx in sorted(positions)]
+
+    def _changed(method):
+        def changed(self, *args):
+            self._index = None
+            return method(self, *args)
+        changed.__name__ = method.__name__
+        return changed
+
+    __setitem__ = _changed(list.__setitem__)
+    __delitem__ = _changed(list.__delitem__)
+    __iadd__ = _changed(list.__iadd__)
+    append = _changed(list.append)
+    extend = _changed(list.extend)
+    insert = _changed(list.insert)
+    pop = _changed(list.pop)
+    remove = _changed(list.remove)
+    reverse = _changed(list.reverse)
+    sort = _changed(list.sort)
+    clear = _changed(list.clear)
+    del _changed
+
+
+def _atom(token, r, new):
+    """
+    Handle an atom containing quotes or parens, exactly as the original
+    per-character parser would: quotes are stripped, an empty quoted string
+    becomes "~", and any unquoted open paren pushes a `new()` list onto `r`
+    which then receives the (whole) atom.
+    """
+    atom = None
     quote = False
-    for c in sexp:
+    for c in token:
         if c == '(' and not quote:
-            r.append([])
-        elif c in (')', ' ', '\n') and not quote:
-            if token is not None:
-                r[-1].append(token)
-            token = None
-            if c == ')':
-                t = r.pop()
-                r[-1].append(t)
+            r.append(new())
         elif c == '"':
             quote = not quote
-            if not token and not quote:
-                token = "~"
+            if not atom and not quote:
+                atom = "~"
         else:
-            if token is None:
-                token = ''
-            token += c
+            atom = c if atom is None else atom + c
+    r[-1].append(atom)
+
+
+def _build(tokens, new=list):
+    """
+    Build Python lists, created by calling `new`, from lists of `tokens`,
+    returning the first complete top-level list.
+    """
+    r = [[]]
+    top = r[0]
+    # Append without going through Node's index invalidation
+    append = list.append
+    # Building millions of small lists repeatedly triggers the cyclic garbage
+    # collector for no benefit, so pause it while the tree is built.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for token in itertools.chain.from_iterable(tokens):
+            if token == '(':
+                top = new()
+                r.append(top)
+            elif token == ')':
+                t = r.pop()
+                top = r[-1]
+                append(top, t)
+            elif '"' not in token and '(' not in token:
+                append(top, token)
+            elif (token[0] == '"' and token[-1] == '"'
+                    and token.count('"') == 2 and '(' not in token):
+                append(top, token[1:-1] or "~")
+            else:
+                _atom(token, r, new)
+                top = r[-1]
+    finally:
+        if gc_enabled:
+            gc.enable()
     return r[0][0]
 
 
+def parse(sexp, nodes=False):
+    """
+    Parse an S-expression into Python lists.
+    With `nodes`, each list is a Node, indexed for fast `find`.
+    """
+    return _build([_token.findall(sexp)], Node if nodes else list)
+
+
+def _iter_tokens(fp, chunk_size):
+    """
+    Yield lists of the tokens of the s-expression read from `fp` in chunks of
+    `chunk_size` characters. An atom running up to the end of a chunk might
+    continue in the next one, so it is held back until more is read.
+    """
+    tail = ""
+    while True:
+        chunk = fp.read(chunk_size)
+        buf = tail + chunk
+        tokens = _token.findall(buf)
+        if chunk and tokens and tokens[-1] not in "()" and \
+                buf.endswith(tokens[-1]):
+            tail = tokens.pop()
+        else:
+            tail = ""
+        yield tokens
+        if not chunk:
+            return
+
+
+def _iter_mapped_tokens(mapped, chunk_size):
+    """
+    Yield lists of the tokens of the s-expression in the memory map `mapped`,
+    scanning `chunk_size` bytes at a time without copying them out of the
+    map. Each distinct atom is only decoded once, and the same str is then
+    used every time it recurs.
+    """
+    decoded = {}
+    get = decoded.get
+
+    def decode(token):
+        atom = decoded[token] = token.decode("utf-8")
+        return atom
+
+    pos = 0
+    size = len(mapped)
+    window = chunk_size
+    while pos < size:
+        end = min(pos + window, size)
+        tokens = _btoken.findall(mapped, pos, end)
+        if end < size and tokens and tokens[-1] not in (b"(", b")") and \
+                mapped[end-len(tokens[-1]):end] == tokens[-1]:
+            end -= len(tokens.pop())
+            if end == pos:
+                # A single atom fills the whole window, so widen it
+                window *= 2
+                continue
+        yield [get(token) or decode(token) for token in tokens]
+        pos = end
+        window = chunk_size
+
+
+def _children(tokens, new=list):
+    """
+    Build the top-level list from lists of `tokens`, yielding each of its
+    children, created by calling `new`, as soon as it is complete.
+    """
+    r = [[]]
+    append = list.append
+    for token in itertools.chain.from_iterable(tokens):
+        if token == '(':
+            r.append(new())
+        elif token == ')':
+            t = r.pop()
+            if len(r) == 2:
+                yield t
+            elif len(r) > 2:
+                append(r[-1], t)
+            else:
+                return
+        else:
+            if '"' not in token and '(' not in token:
+                pass
+            elif (token[0] == '"' and token[-1] == '"'
+                    and token.count('"') == 2 and '(' not in token):
+                token = token[1:-1] or "~"
+            else:
+                _atom(token, r, new)
+                token = r[-1].pop()
+            if len(r) == 2:
+                yield token
+            elif len(r) > 2:
+                append(r[-1], token)
+
+
+def iterparse(fp, nodes=False, chunk_size=65536):
+    """
+    Parse an S-expression from the file object `fp`, yielding each child of
+    the top-level list in turn rather than building the whole tree, so that
+    only one child is held in memory at once.
+
+    list(iterparse(fp)) == parse(fp.read())
+    """
+    return _children(_iter_tokens(fp, chunk_size), Node if nodes else list)
+
+
+def _mmap(f):
+    """Map the whole of the open file `f` read-only."""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iterload(path, nodes=False, chunk_size=1048576):
+    """
+    Parse the S-expression in the file at `path` straight from a read-only
+    memory map of the file, yielding each child of the top-level list in
+    turn as `iterparse` does. The file contents are never copied into one
+    Python string, and each distinct atom is decoded only once.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mapped = _mmap(f)
+    try:
+        tokens = _iter_mapped_tokens(mapped, chunk_size)
+        for child in _children(tokens, Node if nodes else list):
+            yield child
+    finally:
+        mapped.close()
+
+
+def load(path, nodes=False, chunk_size=1048576):
+    """
+    Parse the S-expression in the file at `path` into Python lists, reading
+    it through a memory map as `iterload` does.
+
+    load(path) == parse(open(path).read())
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return parse("", nodes)
+        mapped = _mmap(f)
+    try:
+        tokens = _iter_mapped_tokens(mapped, chunk_size)
+        return _build(tokens, Node if nodes else list)
+    finally:
+        mapped.close()
+
+
+_single_word = re.compile("^-?[a-zA-Z0-9_*\.]+$")
+
+
+def _format(node):
+    """Format a single atom for output."""
+    if isinstance(node, str) and not _single_word.match(node):
+        node = "\"{}\"".format(node)
+    if isinstance(node, (int, Decimal)):
+        node = str(node)
+    if isinstance(node, float):
+        node = "{:.4f}".format(node)
+    return node
+
+
+def _iter_pieces(sexp, depth):
+    """
+    Yield lists of the pieces of text making up the s-expression for `sexp`,
+    one list per top-level child. Atoms which are not strings or numbers are
+    left in the lists as they are.
+    """
+    out = ["\n", " "*depth*2, "("]
+    stack = [iter(sexp)]
+    first = True
+    while stack:
+        for node in stack[-1]:
+            if not first:
+                out.append(" ")
+            first = False
+            if isinstance(node, (list, tuple)):
+                depth += 1
+                out += ["\n", " "*depth*2, "("]
+                stack.append(iter(node))
+                first = True
+                break
+            out.append(_format(node))
+        else:
+            stack.pop()
+            depth -= 1
+            out.append(")")
+            first = False
+            if len(stack) == 1:
+                yield out
+                out = []
+    if out:
+        yield out
+
+
+def iter_generate(sexp, depth=0):
+    """
+    Turn a list of lists into an s-expression, yielding the output in chunks
+    of one top-level child at a time. The joined chunks are identical to
+    the output of `generate`.
+    """
+    for out in _iter_pieces(sexp, depth):
+        yield "".join(out)
+
+
+def template(sexp, hole, depth=0):
+    """
+    Turn a list of lists into an s-expression as `generate` does, except
+    that it is split at every atom which is the object `hole`. Returns the
+    list of the text before, between and after the holes, so that the same
+    expression can be written again with other values in place of the holes
+    without generating it again:
+
+        texts = template(sexp, hole)
+        texts[0] + "".join(v + t for v, t in zip(values, texts[1:]))
+    """
+    texts = []
+    text = []
+    for out in _iter_pieces(sexp, depth):
+        for piece in out:
+            if piece is hole:
+                texts.append("".join(text))
+                text = []
+            else:
+                text.append(piece)
+    texts.append("".join(text))
+    return texts
+
+
 def generate(sexp, depth=0):
     """Turn a list of lists into an s-expression."""
-    single_word = re.compile("^-?[a-zA-Z0-9_*\.]+$")
-    parts = []
-    for node in sexp:
-        if isinstance(node, str) and not single_word.match(node):
-            node.replace("\"", "\\\"")
-            node.replace("\n", "\\n")
-            node = "\"{}\"".format(node)
-        if isinstance(node, (int, Decimal)):
-            node = str(node)
-        if isinstance(node, float):
-            node = "{:.4f}".format(node)
+    return "".join(iter_generate(sexp, depth))
+
+
+def dump(sexp, fp, depth=0):
+    """
+    Write the s-expression for a list of lists to the file object `fp`,
+    without building the whole output in memory first.
+    """
+    for chunk in iter_generate(sexp, depth):
+        fp.write(chunk)
+
+
+class Writer:
+    """
+    Write a top-level list to the file object `fp` one child at a time, so
+    the list never needs to exist in memory. The output is identical to
+    `dump` of the complete list.
+    """
+    def __init__(self, fp, *atoms):
+        self.fp = fp
+        self.fp.write("\n(" + " ".join(_format(atom) for atom in atoms))
+        self.empty = not atoms
+
+    def append(self, node):
+        if not self.empty:
+            self.fp.write(" ")
+        self.empty = False
         if isinstance(node, (list, tuple)):
-            node = generate(node, depth+1)
-        parts.append(node)
-    return "\n{}({})".format(" "*depth*2, " ".join(parts))
+            dump(node, self.fp, depth=1)
+        else:
+            self.fp.write(_format(node))
+
+    def append_text(self, chunks):
+        """
+        Append children from the chunks of their text as generated at depth
+        1, such as by filling in a `template`, with a space between children.
+        """
+        if not self.empty:
+            self.fp.write(" ")
+        self.empty = False
+        for chunk in chunks:
+            self.fp.write(chunk)
+
+    def close(self):
+        self.fp.write(")")
+
+
+# Caches of numeric atoms already converted, emptied when they grow too large
+# so that streaming a huge board still runs in bounded memory.
+_NUMBER_CACHE_SIZE = 1 << 16
+_decimals = {}
+_floats = {}
+
+
+def to_decimal(atom):
+    """
+    Return the numeric `atom` as a Decimal, converting each distinct atom
+    only once and returning the cached value after that.
+    """
+    try:
+        return _decimals[atom]
+    except KeyError:
+        if len(_decimals) >= _NUMBER_CACHE_SIZE:
+            _decimals.clear()
+        value = _decimals[atom] = Decimal(atom)
+        return value
+
+
+def to_float(atom):
+    """
+    Return the numeric `atom` as a float, converting each distinct atom
+    only once and returning the cached value after that.
+    """
+    try:
+        return _floats[atom]
+    except KeyError:
+        if len(_floats) >= _NUMBER_CACHE_SIZE:
+            _floats.clear()
+        value = _floats[atom] = float(atom)
+        return value
 
 
 def find(sexp, *names):
     """Return the first node in `sexp` whose name is in `names`"""
+    if isinstance(sexp, Node):
+        return sexp.find(*names)
     for child in sexp:
         if child[0] in names:
             return child
@@ -68,6 +494,125 @@ def find(sexp, *names):
 
 def find_all(sexp, *names):
     """Yield all nodes in `sexp` whose name is in `names`."""
+    if isinstance(sexp, Node):
+        for child in sexp.find_all(*names):
+            yield child
+        return
     for child in sexp:
         if child[0] in names:
             yield child
+
+
+# A query segment is a name (or several separated by "|", or "*" for any
+# name) followed by any number of [predicates], each of which is either
+# "key", "key=value" or "key~value" where the value may also list several
+# alternatives separated by "|".
+_segment = re.compile(r"([^/\[\]]+)((?:\[[^\]]*\])*)$")
+_predicate = re.compile(r"\[([^\]=~]+)(?:([=~])([^\]]*))?\]")
+_queries = {}
+
+
+def _children_named(node, names):
+    """Return the children of `node` named in `names`, or all if None."""
+    if names is None:
+        return [child for child in node if isinstance(child, list) and child]
+    if isinstance(node, Node):
+        return node.find_all(*names)
+    if len(names) == 1:
+        name = names[0]
+        return [child for child in node
+                if isinstance(child, list) and child and child[0] == name]
+    return [child for child in node
+            if isinstance(child, list) and child and child[0] in names]
+
+
+def _contains(values, atoms):
+    """Check whether any of `atoms` is in `values`, skipping nested lists."""
+    for atom in atoms:
+        if not isinstance(atom, list) and atom in values:
+            return True
+    return False
+
+
+def _predicate_test(key, op, values):
+    """Return a function checking a node against a single predicate."""
+    if key.isdigit():
+        key = int(key)
+        if not op:
+            return lambda node: len(node) > key
+        return lambda node: _contains(values, node[key:key + 1])
+
+    if not op:
+        def test(node):
+            for child in node:
+                if isinstance(child, list) and child and child[0] == key:
+                    return True
+            return False
+    elif op == "=":
+        def test(node):
+            for child in node:
+                if isinstance(child, list) and len(child) > 1 and \
+                        child[0] == key and \
+                        not isinstance(child[1], list) and child[1] in values:
+                    return True
+            return False
+    else:
+        def test(node):
+            for child in node:
+                if isinstance(child, list) and child and child[0] == key \
+                        and _contains(values, child[1:]):
+                    return True
+            return False
+    return test
+
+
+def _compile(path):
+    """Compile a query path into a list of (names, tests) steps."""
+    try:
+        return _queries[path]
+    except KeyError:
+        pass
+    steps = []
+    for part in path.split("/"):
+        match = _segment.match(part)
+        if not match:
+            raise ValueError("Invalid query '{}'".format(path))
+        names = match.group(1).split("|")
+        tests = [_predicate_test(key, op, frozenset(value.split("|")))
+                 for key, op, value in _predicate.findall(match.group(2))]
+        steps.append((None if names == ["*"] else names, tests))
+    _queries[path] = steps
+    return steps
+
+
+def select(sexp, path):
+    """
+    Yield all nodes in `sexp` matching the query `path`, which names one
+    level of children per "/"-separated segment. Each segment may be
+    restricted by predicates on the node's children or atoms, for example:
+
+        select(board, "module/pad[layers~F.Cu]/at")
+        select(mod, "fp_line|fp_arc[layer=F.SilkS|B.SilkS]/width")
+        select(mod, "fp_text[1=reference]/effects/font/size")
+
+    where [layers~F.Cu] matches nodes with a `layers` child containing F.Cu,
+    [layer=F.SilkS] matches nodes whose `layer` child's value is F.SilkS,
+    and [1=reference] matches nodes whose first atom after the name is
+    `reference`. Using Node trees lets each level use their name index.
+    """
+    nodes = [sexp]
+    for names, tests in _compile(path):
+        found = []
+        for node in nodes:
+            found += _children_named(node, names)
+        for test in tests:
+            found = [node for node in found if test(node)]
+        nodes = found
+    for node in nodes:
+        yield node
+
+
+def select_one(sexp, path):
+    """Return the first node in `sexp` matching the query `path`, or None."""
+    for node in select(sexp, path):
+        return node
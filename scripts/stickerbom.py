@@ -36,6 +36,11 @@ import xml.etree.ElementTree as ET
 import sexp
 
 
+def floats(node, name):
+    """Return the numbers in the child `name` of `node` as floats."""
+    return [sexp.to_float(x) for x in sexp.find(node, name)[1:]]
+
+
 class Module:
     def __init__(self, mod):
         self.fab_lines = []
@@ -111,7 +116,7 @@ class Module:
         cr.restore()
 
     def _parse(self, mod):
-        self.at = [float(x) for x in sexp.find(mod, "at")[1:]]
+        self.at = floats(mod, "at")
         self.bounds = [0, 0, 0, 0]
         for text in sexp.find_all(mod, "fp_text"):
             if text[1] == "reference":
@@ -128,12 +133,12 @@ class Module:
     def _parse_graphic(self, graphic):
         layer = sexp.find(graphic, "layer")[1]
         if graphic[0] == "fp_line":
-            start = [float(x) for x in sexp.find(graphic, "start")[1:]]
+            start = floats(graphic, "start")
             self._update_bounds(start)
         elif graphic[0] == "fp_circle":
-            center = [float(x) for x in sexp.find(graphic, "center")[1:]]
+            center = floats(graphic, "center")
             self._update_bounds(center)
-        end = [float(x) for x in sexp.find(graphic, "end")[1:]]
+        end = floats(graphic, "end")
         self._update_bounds(end)
 
         if layer == "F.Fab":
@@ -154,15 +159,15 @@ class Module:
         pad_type = pad[2]
         if pad_type not in ("smd", "thru_hole"):
             return
-        at = [float(x) for x in sexp.find(pad, "at")[1:]]
+        at = floats(pad, "at")
         self._update_bounds(at)
-        size = [float(x) for x in sexp.find(pad, "size")[1:]]
+        size = floats(pad, "size")
         drill = sexp.find(pad, "drill")
         if drill:
             offset = sexp.find(drill, "offset")
             if offset:
-                at[0] += float(offset[1])
-                at[1] += float(offset[2])
+                at[0] += sexp.to_float(offset[1])
+                at[1] += sexp.to_float(offset[2])
         topleft = at[0] - size[0]/2, at[1] - size[1]/2
         shape = pad[3]
         if shape in ("rect", "oval"):
@@ -287,43 +292,45 @@ class PCB:
         return hl_bounds
 
     def _parse(self, board):
-        general = sexp.find(board, "general")
-        self.bounds = [float(x) for x in sexp.find(general, "area")[1:]]
+        # `board` may be a one-shot iterator over the top-level nodes,
+        # so everything is picked out in a single pass.
+        for node in board:
+            if node[0] == "general":
+                self.bounds = floats(node, "area")
+            elif node[0] == "module":
+                self.modules.append(Module(node))
+            elif node[0] in ("gr_line", "gr_arc", "gr_circle"):
+                self._parse_edge(node)
+
         self.width = self.bounds[2] - self.bounds[0]
         self.height = self.bounds[3] - self.bounds[1]
 
-        for module in sexp.find_all(board, "module"):
-            self.modules.append(Module(module))
-
-        self._parse_edges(board)
-
-    def _parse_edges(self, board):
-        for graphic in sexp.find_all(board, "gr_line", "gr_arc", "gr_circle"):
-            layer = sexp.find(graphic, "layer")[1]
-            if layer != "Edge.Cuts":
-                continue
-            if graphic[0] == "gr_line":
-                start = [float(x) for x in sexp.find(graphic, "start")[1:]]
-                end = [float(x) for x in sexp.find(graphic, "end")[1:]]
-                self.edge_lines.append((start, end))
-            elif graphic[0] == "gr_arc":
-                center = [float(x) for x in sexp.find(graphic, "start")[1:]]
-                start = [float(x) for x in sexp.find(graphic, "end")[1:]]
-                r = math.sqrt((center[0] - start[0])**2 +
-                              (center[1] - start[1])**2)
-                angle = float(sexp.find(graphic, "angle")[1]) * math.pi/180.0
-                dx = start[0] - center[0]
-                dy = start[1] - center[1]
-                start_angle = math.atan2(dy, dx)
-                end_angle = start_angle + angle
-                self.edge_arcs.append((center[0], center[1], r,
-                                       start_angle, end_angle))
-            elif graphic[0] == "gr_circle":
-                center = [float(x) for x in sexp.find(graphic, "center")[1:]]
-                end = [float(x) for x in sexp.find(graphic, "end")[1:]]
-                r = math.sqrt((center[0] - end[0])**2 +
-                              (center[1] - end[1])**2)
-                self.edge_arcs.append((center[0], center[1], r, 0, 2*math.pi))
+    def _parse_edge(self, graphic):
+        layer = sexp.find(graphic, "layer")[1]
+        if layer != "Edge.Cuts":
+            return
+        if graphic[0] == "gr_line":
+            start = floats(graphic, "start")
+            end = floats(graphic, "end")
+            self.edge_lines.append((start, end))
+        elif graphic[0] == "gr_arc":
+            center = floats(graphic, "start")
+            start = floats(graphic, "end")
+            r = math.sqrt((center[0] - start[0])**2 +
+                          (center[1] - start[1])**2)
+            angle = floats(graphic, "angle")[0] * math.pi/180.0
+            dx = start[0] - center[0]
+            dy = start[1] - center[1]
+            start_angle = math.atan2(dy, dx)
+            end_angle = start_angle + angle
+            self.edge_arcs.append((center[0], center[1], r,
+                                   start_angle, end_angle))
+        elif graphic[0] == "gr_circle":
+            center = floats(graphic, "center")
+            end = floats(graphic, "end")
+            r = math.sqrt((center[0] - end[0])**2 +
+                          (center[1] - end[1])**2)
+            self.edge_arcs.append((center[0], center[1], r, 0, 2*math.pi))
 
 
 class BOM:
@@ -425,8 +432,7 @@ def sheet_positions(cr, label_width, label_height, labels_x, labels_y,
 def main(xmlpath, pdfpath):
     bom = BOM(xmlpath)
 
-    with open(xmlpath[:-3] + "kicad_pcb") as f:
-        pcb = PCB(sexp.parse(f.read()))
+    pcb = PCB(sexp.iterload(xmlpath[:-3] + "kicad_pcb", nodes=True))
 
     mm_to_pt = 2.835
     ps = cairo.PDFSurface(pdfpath, page_width*mm_to_pt, page_height*mm_to_pt)
@@ -0,0 +1,204 @@
+"""
+test_build_cache.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Check when the build and check caches consider parts and files out of date.
+
+Usage: python -m unittest discover -s scripts -p "test_*.py"
+"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import types
+import shutil
+import tempfile
+import unittest
+
+from build_cache import BuildCache, CheckCache
+
+BUILDER = '''
+PITCH = {pitch}
+
+config = {{
+    "a": {{"pins": {a}}},
+    "b": {{"pins": 2}},
+}}
+
+
+def build(conf):
+    return "pins {{}} pitch {{}}".format(conf["pins"], PITCH)
+'''
+
+RULES = '''
+def checkname(name, errs):
+    if not name.startswith("{prefix}"):
+        errs.append("Bad name")
+'''
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.modules = []
+
+    def tearDown(self):
+        for name in self.modules:
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.tmp)
+
+    def module(self, name, source):
+        """Write the module `name`, registered without being imported."""
+        path = os.path.join(self.tmp, name + ".py")
+        with open(path, "w") as f:
+            f.write(source)
+        module = types.ModuleType(name)
+        module.__file__ = path
+        sys.modules[name] = module
+        self.modules.append(name)
+
+
+class BuildCacheTest(CacheTest):
+    def setUp(self):
+        CacheTest.setUp(self)
+        self.out = os.path.join(self.tmp, "out")
+        os.mkdir(self.out)
+
+    def builder(self, pitch=100, a=1):
+        self.module("fake_builder", BUILDER.format(pitch=pitch, a=a))
+
+    def build(self, config):
+        """
+        Build each part in `config` as a builder does, returning the names of
+        the parts which had to be built.
+        """
+        cache = BuildCache(self.out, "fake_builder", ("fake_builder",))
+        built = []
+        for name, conf in sorted(config.items()):
+            key = cache.key(name, conf)
+            if cache.paths(key) is not None:
+                continue
+            path = os.path.join(self.out, name + ".part")
+            with open(path, "w") as f:
+                f.write(repr(conf))
+            cache.update(key, path)
+            built.append(name)
+        cache.save()
+        return built
+
+    def test_unchanged(self):
+        self.builder()
+        config = {"a": {"pins": 1}, "b": {"pins": 2}}
+        self.assertEqual(self.build(config), ["a", "b"])
+        self.assertEqual(self.build(config), [])
+
+    def test_config_entry(self):
+        # Editing one config entry only rebuilds the part built from it
+        self.builder(a=1)
+        self.assertEqual(self.build({"a": {"pins": 1}, "b": {"pins": 2}}),
+                         ["a", "b"])
+        self.builder(a=3)
+        self.assertEqual(self.build({"a": {"pins": 3}, "b": {"pins": 2}}),
+                         ["a"])
+
+    def test_constant(self):
+        # Editing code outside config rebuilds every part
+        self.builder(pitch=100)
+        config = {"a": {"pins": 1}, "b": {"pins": 2}}
+        self.assertEqual(self.build(config), ["a", "b"])
+        self.builder(pitch=127)
+        self.assertEqual(self.build(config), ["a", "b"])
+        self.assertEqual(self.build(config), [])
+
+    def test_output_edited(self):
+        self.builder()
+        config = {"a": {"pins": 1}, "b": {"pins": 2}}
+        self.build(config)
+        with open(os.path.join(self.out, "b.part"), "a") as f:
+            f.write("edited")
+        self.assertEqual(self.build(config), ["b"])
+
+
+class CheckCacheTest(CacheTest):
+    def setUp(self):
+        CacheTest.setUp(self)
+        self.environ = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = os.path.join(self.tmp, "cache")
+        self.checked = os.path.join(self.tmp, "part.lib")
+        self.write("PART")
+        self.module("fake_rules", RULES.format(prefix="P"))
+
+    def tearDown(self):
+        if self.environ is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = self.environ
+        CacheTest.tearDown(self)
+
+    def write(self, contents):
+        with open(self.checked, "w") as f:
+            f.write(contents)
+
+    def check(self):
+        """
+        Check the file as a checker does, returning its result and whether
+        it was found in the cache.
+        """
+        cache = CheckCache("fake_check", ("fake_rules",))
+        key = cache.key(self.checked)
+        result = cache.get(key)
+        if result is not None:
+            return result, True
+        with open(self.checked) as f:
+            result = [] if f.read().startswith("P") else ["Bad name"]
+        cache.set(key, result)
+        cache.save()
+        return result, False
+
+    def test_unchanged(self):
+        self.assertEqual(self.check(), ([], False))
+        self.assertEqual(self.check(), ([], True))
+
+    def test_file_edited(self):
+        self.check()
+        self.write("QART")
+        self.assertEqual(self.check(), (["Bad name"], False))
+        self.assertEqual(self.check(), (["Bad name"], True))
+
+    def test_rules_edited(self):
+        self.check()
+        self.module("fake_rules", RULES.format(prefix="PA"))
+        self.assertEqual(self.check()[1], False)
+
+    def test_concurrent_save(self):
+        # Two runs which overlap both keep their results
+        first = CheckCache("fake_check", ("fake_rules",))
+        second = CheckCache("fake_check", ("fake_rules",))
+        first_key = first.key(self.checked, "first")
+        second_key = second.key(self.checked, "second")
+        first.set(first_key, ["first"])
+        second.set(second_key, ["second"])
+        first.save()
+        second.save()
+        cache = CheckCache("fake_check", ("fake_rules",))
+        self.assertEqual(cache.get(first_key), ["first"])
+        self.assertEqual(cache.get(second_key), ["second"])
+
+        # Nor does another checker's section get lost
+        other = CheckCache("other_check", ("fake_rules",))
+        other_key = other.key(self.checked)
+        other.set(other_key, [])
+        third = CheckCache("fake_check", ("fake_rules",))
+        third.set(third.key(self.checked, "third"), ["third"])
+        other.save()
+        third.save()
+        self.assertEqual(CheckCache("other_check", ("fake_rules",))
+                         .get(other_key), [])
+        self.assertEqual(CheckCache("fake_check", ("fake_rules",))
+                         .get(first_key), ["first"])
+
+
+if __name__ == "__main__":
+    unittest.main()
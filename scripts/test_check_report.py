@@ -0,0 +1,124 @@
+"""
+test_check_report.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Check the JSON and JUnit reports for files checked in this run and for files
+whose results were cached.
+
+Usage: python -m unittest discover -s scripts -p "test_*.py"
+"""
+
+from __future__ import print_function, division
+
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import contextlib
+import xml.etree.ElementTree as ET
+
+import check_mod
+from check_report import RuleResults, format_json, format_junit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rule_ok(errs):
+    pass
+
+
+def rule_bad(errs):
+    errs.append("Broken")
+
+
+def suite_properties(suite):
+    return dict((prop.get("name"), prop.get("value"))
+                for prop in suite.find("properties"))
+
+
+class FormatTest(unittest.TestCase):
+    def setUp(self):
+        checked = RuleResults()
+        checked.run(rule_ok)
+        checked.run(rule_bad)
+        cached = RuleResults([["rule_bad", "Broken"]],
+                             {"rule_ok": 0.25, "rule_bad": 0.5}, cached=True)
+        self.files = [("a", checked), ("b", cached), ("c", None)]
+
+    def test_json(self):
+        report = json.loads(format_json("test", self.files))
+        a, b, c = report["files"]
+        self.assertFalse(a["cached"])
+        self.assertEqual(set(a["times"]), set(["rule_ok", "rule_bad"]))
+        self.assertTrue(b["cached"])
+        self.assertEqual(b["times"], {"rule_ok": 0.25, "rule_bad": 0.5})
+        self.assertEqual(b["errors"], [{"rule": "rule_bad",
+                                        "message": "Broken"}])
+        self.assertEqual(c["status"], "skipped")
+        self.assertGreaterEqual(report["rules"]["rule_bad"], 0.5)
+
+    def test_junit(self):
+        suites = ET.fromstring(format_junit("test", self.files))
+        suite = suites.find("testsuite")
+        self.assertEqual(suite.get("failures"), "2")
+        self.assertEqual(suite.get("skipped"), "1")
+        self.assertGreaterEqual(float(suite.get("time")), 0.75)
+        props = suite_properties(suite)
+        self.assertEqual(props["cached.b"], "0.750000")
+        self.assertNotIn("cached.a", props)
+        self.assertGreaterEqual(float(props["time.rule_ok"]), 0.25)
+        cases = dict((case.get("name"), case)
+                     for case in suite.findall("testcase"))
+        self.assertEqual(cases["b"].get("time"), "0.750000")
+        # Test cases only hold what the JUnit schema allows them
+        for case in cases.values():
+            for child in case:
+                self.assertIn(child.tag, ("failure", "skipped"))
+
+
+class CachedCheckTest(unittest.TestCase):
+    """Check a footprint twice, the second time from the cache."""
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.environ = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = os.path.join(self.tmp, "cache")
+        self.pretty = os.path.join(self.tmp, "test.pretty")
+        os.mkdir(self.pretty)
+        shutil.copy(os.path.join(ROOT, "agg.pretty", "0402.kicad_mod"),
+                    self.pretty)
+
+    def tearDown(self):
+        if self.environ is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = self.environ
+        shutil.rmtree(self.tmp)
+
+    def report(self, fmt):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            check_mod.main(self.pretty, fmt=fmt)
+        return out.getvalue()
+
+    def test_cached_times(self):
+        first = json.loads(self.report("json"))["files"][0]
+        second = json.loads(self.report("json"))["files"][0]
+        self.assertFalse(first["cached"])
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["times"], first["times"])
+        self.assertEqual(set(first["times"]), set(
+            ["checkrefval", "checkfont", "checksilk", "checkctyd"]))
+
+        suite = ET.fromstring(self.report("junit")).find("testsuite")
+        case = suite.find("testcase")
+        recorded = "{:.6f}".format(sum(first["times"].values()))
+        self.assertEqual(case.get("time"), recorded)
+        self.assertEqual(suite_properties(suite)["cached." + case.get("name")],
+                         recorded)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+test_git_version.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Check that HEAD is resolved to the commit git finds, with loose and packed
+refs, and that versions match `git describe` as the repository changes.
+
+Usage: python -m unittest discover -s scripts -p "test_*.py"
+"""
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import git_version
+
+
+class GitVersionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmp, "repo")
+        os.mkdir(self.repo)
+        self.git("init", "-q")
+        self.commit("first")
+        git_version.clear()
+
+    def tearDown(self):
+        git_version.clear()
+        shutil.rmtree(self.tmp)
+
+    def git(self, *args):
+        env = dict(os.environ, GIT_AUTHOR_NAME="Test",
+                   GIT_AUTHOR_EMAIL="test@example.com",
+                   GIT_COMMITTER_NAME="Test",
+                   GIT_COMMITTER_EMAIL="test@example.com")
+        env.pop("GIT_DIR", None)
+        env.pop("GIT_INDEX_FILE", None)
+        return subprocess.check_output(("git",) + args, cwd=self.repo,
+                                       env=env).decode().strip()
+
+    def commit(self, contents):
+        with open(os.path.join(self.repo, "file"), "w") as f:
+            f.write(contents)
+        self.git("add", "file")
+        self.git("commit", "-q", "-m", contents)
+
+    def check(self):
+        self.assertEqual(git_version.resolve(self.repo),
+                         self.git("rev-parse", "HEAD"))
+        self.assertEqual(git_version.git_version(self.repo),
+                         git_version.git_describe(self.repo))
+
+    def test_refs(self):
+        self.check()
+        self.git("pack-refs", "--all")
+        branch = self.git("symbolic-ref", "HEAD")
+        self.assertFalse(os.path.exists(
+            os.path.join(self.repo, ".git", *branch.split("/"))))
+        self.check()
+        self.commit("second")
+        self.check()
+        self.git("checkout", "-q", "HEAD~1")
+        self.check()
+        self.assertIsNone(git_version.resolve(self.tmp))
+
+    def test_worktree(self):
+        worktree = os.path.join(self.tmp, "worktree")
+        self.git("worktree", "add", "-q", "--detach", worktree, "HEAD")
+        self.assertTrue(os.path.isfile(os.path.join(worktree, ".git")))
+        self.assertEqual(git_version.resolve(worktree),
+                         self.git("rev-parse", "HEAD"))
+
+    def test_tags(self):
+        self.git("tag", "-a", "-m", "v1", "v1")
+        self.check()
+        self.assertEqual(git_version.git_version(self.repo), "v1")
+        self.commit("second")
+        self.check()
+        self.assertTrue(git_version.git_version(self.repo).startswith("v1-1-"))
+
+    def test_dirty(self):
+        clean = git_version.git_version(self.repo)
+        with open(os.path.join(self.repo, "file"), "w") as f:
+            f.write("edited")
+        # The version is kept until cleared, unless HEAD moves
+        self.assertEqual(git_version.git_version(self.repo), clean)
+        git_version.clear()
+        self.assertEqual(git_version.git_version(self.repo), clean + "-dirty")
+        self.check()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+test_kicad_lib.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Check that parsing and emitting a library reproduces it byte-for-byte, for
+every library in the repository and for lines the parser handles specially.
+
+Usage: python -m unittest discover -s scripts -p "test_*.py"
+"""
+
+from __future__ import print_function, division
+
+import os
+import unittest
+
+import kicad_lib
+from compile_lib import libpaths
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LIBRARY = """EESchema-LIBRARY Version 2.3
+#encoding utf-8
+#
+# PART
+#
+DEF PART U 0 40 Y Y 1 F N
+F0 "U" 0 100 50 H V C CNN
+F1 "PART" 0 -100 50 H V C CNN
+F2 "" 0 0 50 H I C CNN
+F3 "" 0 0 50 H I C CNN
+F4 "" 0 0 50 H I C CNN "Order Code"
+F5 "X" 0 0 50 H I C CNN\t
+DRAW
+S -100 100 100 -100 0 1 0 f
+X A 1 -200 0 100 R 50 50 1 1 I
+X B 2 200 0 100 L 50 50 1 1 O I
+X C 3 200 100 100 L 50 50 1 1 O\x20\x20
+X D 4 200 -100 100 L 50 50 1 1 O I extra
+X  E  5  -200 -100 100 R 50 50 1 1 P
+ENDDRAW
+ENDDEF
+#
+# End Library"""
+
+
+class RoundTripTest(unittest.TestCase):
+    def check(self, text):
+        self.assertEqual(kicad_lib.parse(text).emit(), text)
+
+    def check_file(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        lib = kicad_lib.parse(data.decode("utf-8"))
+        self.assertEqual(lib.emit().encode("utf-8"), data, path)
+
+    def test_libraries(self):
+        paths = list(libpaths(os.path.join(ROOT, "lib")))
+        self.assertTrue(paths)
+        for path in paths:
+            self.check_file(path)
+
+    def test_compiled_library(self):
+        self.check_file(os.path.join(ROOT, "agg-kicad.lib"))
+
+    def test_special_lines(self):
+        self.check(LIBRARY)
+        self.check(LIBRARY + "\n")
+        self.check(LIBRARY.replace("ENDDEF\n", ""))
+
+    def test_trailing_text(self):
+        symbol = kicad_lib.parse(LIBRARY).symbols[0]
+        pins = dict((pin.num, pin) for pin in symbol.pins)
+        self.assertEqual(sorted(pins), ["1", "2", "3", "4"])
+        self.assertEqual(pins["2"].shape, "I")
+        self.assertEqual(pins["3"].extra, "  ")
+        self.assertEqual(pins["4"].extra, " extra")
+        self.assertIn("X  E  5  -200 -100 100 R 50 50 1 1 P", symbol.body)
+        self.assertEqual(symbol.field(4).extra, ' "Order Code"')
+        self.assertEqual(symbol.field(5).extra, "\t")
+
+    def test_empty_fields(self):
+        symbol = kicad_lib.parse(LIBRARY).symbols[0]
+        for number in (2, 3, 4):
+            self.assertEqual(symbol.field(number).value, "")
+        self.assertEqual(symbol.field(2).emit(), 'F2 "" 0 0 50 H I C CNN')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+"""
+test_panelise.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Check that panelising a small board gives the same output whether copies are
+made with Decimal arithmetic, with NumPy or in worker processes, for every
+way of keeping zone fills and every rotation.
+
+Usage: python -m unittest discover -s scripts -p "test_*.py"
+"""
+
+from __future__ import print_function, division
+
+import io
+import os
+import re
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+import contextlib
+from decimal import Decimal
+
+import panelise
+
+BOARD = """(kicad_pcb (version 4) (host pcbnew "(2015-08-01)-product")
+  (general (links 2) (area 0 0 30 30))
+  (page A4)
+  (layers (0 F.Cu signal) (31 B.Cu signal))
+  (setup (last_trace_width 0.25))
+  (net 0 "")
+  (net 1 GND)
+  (net_class Default "This is the default net class.")
+  (module R_0402 (layer F.Cu) (tedit 5598F1A6) (tstamp 55BA1C2A)
+    (at 10 20.5)
+    (fp_text reference R1 (at 0 -1.5 unlocked) (layer F.SilkS)
+      (effects (font (size 1 1) (thickness 0.15))))
+    (fp_text value 1k (at 0 1.5 90) (layer F.Fab)
+      (effects (font (size 1 1) (thickness 0.15))))
+    (fp_line (start -1 -0.5) (end 1 -0.5) (layer F.SilkS) (width 0.15))
+    (pad 1 smd rect (at -0.5 0) (size 0.5 0.6) (layers F.Cu) (net 1 GND))
+    (pad 2 smd rect (at 0.5 0 180) (size 0.5 0.6) (layers F.Cu)))
+  (module SOT-23 (layer F.Cu) (at 20.25 -0 270)
+    (pad 1 smd rect (at -0.95 1 270) (size 0.6 0.7) (layers F.Cu)))
+  (gr_text "agg-kicad" (at 5 5) (layer F.SilkS)
+    (effects (font (size 1 1) (thickness 0.15))))
+  (gr_line (start 0 0) (end 30 0) (angle 90) (layer Edge.Cuts) (width 0.15))
+  (gr_arc (start 15 15) (end 30 15.000001) (angle -90) (layer Edge.Cuts)
+    (width 0.15))
+  (segment (start 10.5 20.5) (end 19.3 -0.00) (width 0.25) (layer F.Cu)
+    (net 1))
+  (via (at 19.3 0.000) (size 0.6) (drill 0.4) (layers F.Cu B.Cu) (net 1))
+  (zone (net 1) (net_name GND) (layer B.Cu) (hatch edge 0.508)
+    (polygon (pts (xy 0 0) (xy 30 0) (xy 30 30) (xy 0 30)))
+    (filled_polygon (pts (xy 0.5 0.5) (xy 29.5 0.5) (xy 29.5 29.5))))
+)
+"""
+
+# The host line records when the panel was made
+re_host = re.compile(r"\(host panelise\.py [^)]*\)")
+
+ANGLES = (0, 90, 180, 270)
+
+
+class PaneliseTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.board = os.path.join(self.tmp, "board.kicad_pcb")
+        with open(self.board, "w") as f:
+            f.write(BOARD)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def panel(self, *args, **kwargs):
+        """Return the panel of the test board made with `args`."""
+        outpath = os.path.join(self.tmp, "panel.kicad_pcb")
+        with contextlib.redirect_stdout(io.StringIO()):
+            panelise.main(self.board, outpath, 3, Decimal("35.5"), 2,
+                          Decimal(40), *args, **kwargs)
+        with open(outpath) as f:
+            return re_host.sub("(host panelise.py)", f.read())
+
+    def decimal_panel(self, *args, **kwargs):
+        numpy = panelise.numpy
+        panelise.numpy = None
+        try:
+            return self.panel(*args, **kwargs)
+        finally:
+            panelise.numpy = numpy
+
+    def test_paths_identical(self):
+        for fills in ("keep", "first", "drop"):
+            for rotate in ANGLES:
+                for alternate in ANGLES:
+                    args = dict(fills=fills, rotate=rotate,
+                                alternate=alternate)
+                    sequential = self.decimal_panel(**args)
+                    if panelise.numpy is not None:
+                        self.assertEqual(self.panel(**args), sequential,
+                                         args)
+                    self.assertEqual(self.panel(jobs=2, **args), sequential,
+                                     args)
+
+    def test_numpy(self):
+        if panelise.numpy is None:
+            self.skipTest("NumPy is not installed")
+        board = panelise.Board()
+        board.add(panelise.template(
+            ["via", ["at", "19.3", "-0"]], panelise.simple))
+        board.prepare()
+        self.assertTrue(board.points)
+
+    def test_rotation(self):
+        # The via is at (19.3, 0) on a board whose middle is (15, 15), so
+        # rotating it anticlockwise by 90 degrees, with y pointing down,
+        # moves it to (0, 10.7)
+        board = panelise.Board()
+        for node in (["via", ["at", "19.3", "0"]],
+                     ["gr_line", ["start", "0", "0"], ["end", "30", "30"]]):
+            board.add(panelise.template(node, panelise.simple, True))
+        expected = {0: "(at 19.3 0)", 90: "(at 0 10.7)",
+                    180: "(at 10.7 30)", 270: "(at 30 19.3)"}
+        for rotation, at in expected.items():
+            self.assertIn(at, board.text(0, 0, rotation))
+        self.assertIn("(at 19.3 -40)", board.text(0, -40))
+
+        # Module, pad and text angles turn with the board, wrapping at 360
+        ats = re.findall(r"\(at [^)]*\)", self.decimal_panel(rotate=90))
+        self.assertEqual(ats[:9], [
+            "(at 20.5 20 90)", "(at 0 -1.5 90 unlocked)", "(at 0 1.5 180)",
+            "(at -0.5 0 90)", "(at 0.5 0 270)", "(at 0.0 9.75 0)",
+            "(at -0.95 1 0)", "(at 5.0 25 90)", "(at 0.000 10.7)"])
+        self.assertEqual(ats[9], "(at 20.5 60 90)")
+
+        # Copies are written a column at a time, and every other copy in a
+        # checkerboard has the alternate rotation too
+        ats = re.findall(r"\(at [^)]*\)", self.decimal_panel(alternate=180))
+        angles = [at.split()[3:4] for at in ats[::9]]
+        self.assertEqual(angles, [[], ["180)"], ["180)"], [], [], ["180)"]])
+
+    def test_jobs_zero(self):
+        outpath = os.path.join(self.tmp, "panel.kicad_pcb")
+        result = subprocess.run(
+            [sys.executable, panelise.__file__, self.board, "1", "10", "1",
+             "10", outpath, "--jobs", "0"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(result.returncode, 1)
+        self.assertIn(b"Usage", result.stdout)
+        self.assertFalse(os.path.exists(outpath))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+test_sexp.py
+Copyright 2015 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Check the S-expression emitter produces exactly the output of the original
+recursive emitter.
+
+Usage: python -m unittest discover -s scripts -p "test_*.py"
+"""
+
+from __future__ import print_function, division
+
+import re
+import unittest
+from decimal import Decimal
+
+import sexp
+
+
+def generate_recursive(node, depth=0):
+    """The original recursive emitter, kept as a reference."""
+    single_word = re.compile(r"^-?[a-zA-Z0-9_*\.]+$")
+    parts = []
+    for child in node:
+        if isinstance(child, str) and not single_word.match(child):
+            child = "\"{}\"".format(child)
+        if isinstance(child, (int, Decimal)):
+            child = str(child)
+        if isinstance(child, float):
+            child = "{:.4f}".format(child)
+        if isinstance(child, (list, tuple)):
+            child = generate_recursive(child, depth+1)
+        parts.append(child)
+    return "\n{}({})".format(" "*depth*2, " ".join(parts))
+
+
+class GenerateTest(unittest.TestCase):
+    def check(self, node):
+        self.assertEqual(sexp.generate(node), generate_recursive(node))
+
+    def test_empty_list_then_sibling(self):
+        self.assertEqual(sexp.generate([[], "b"]), "\n(\n  () b)")
+        self.check([[], "b"])
+        self.check(["a", [], [], "b"])
+        self.check(["a", [[]], "b"])
+
+    def test_nested(self):
+        self.check(["module", "R", ["at", 1, Decimal("2.50")],
+                    ["fp_text", "value", "a b", ["at", 0.5, -1]],
+                    ["pad", 1, [], ["layers", "F.Cu", "F.Mask"]], "end"])
+
+    def test_depth(self):
+        node = ["via", ["at", 1, 2], [], "x"]
+        self.assertEqual(sexp.generate(node, depth=2),
+                         generate_recursive(node, depth=2))
+
+
+if __name__ == "__main__":
+    unittest.main()